@@ -0,0 +1,156 @@
+import heapq
+from array import array
+from BinaryIndex import decode_postings_arrays
+from PostingsCache import CachedPostingsReader
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+BACKENDS = ("auto", "python", "numpy")
+NUMPY_AVAILABLE = np is not None
+
+# below this many candidates per result a full sort is faster than a heap
+HEAP_SELECTION_RATIO = 16
+
+
+class Accumulators:
+    """
+    Score accumulators for term-at-a-time BM25, backed by a flat array of one
+    double per internal id that is allocated once and reused across queries.
+    The documents touched by a query are kept in the order they were first
+    scored, which is the order the exhaustive ranking breaks ties in, and
+    only those are reset after the query.
+    """
+
+    def __init__(self, num_docs):
+        self.num_docs = num_docs
+        self.scores = array("d", bytes(8 * num_docs))
+        self.seen = bytearray(num_docs)
+        self.touched = []
+
+    def add_term(self, inverted_index, term_id, idf, length_norms):
+        self.add_postings(inverted_index.postings(term_id), idf, length_norms)
+
+    def add_postings(self, postings, idf, length_norms):
+        """
+        Adds idf * fi / (fi + K) for every posting of an interleaved
+        [doc_id, count, ...] list.
+        """
+        doc_ids = postings[0::2]
+        seen = self.seen
+        new_doc_ids = [doc_id for doc_id in doc_ids if not seen[doc_id]]
+        for doc_id in new_doc_ids:
+            seen[doc_id] = 1
+        self.touched.extend(new_doc_ids)
+
+        scores = self.scores
+        for doc_id, fi in zip(doc_ids, postings[1::2]):
+            scores[doc_id] += idf * (fi / (fi + length_norms[doc_id]))
+
+    def top_k(self, k, allowed=None):
+        """
+        Returns the k best (doc_id, score) pairs, in the same order as sorting
+        all of them by score, without sorting the whole list.
+        """
+        doc_ids = self.touched
+        if allowed is not None:
+            doc_ids = [doc_id for doc_id in doc_ids if doc_id in allowed]
+        scores = self.scores
+        if len(doc_ids) > HEAP_SELECTION_RATIO * k:
+            best = heapq.nlargest(k, doc_ids, key=scores.__getitem__)
+        else:
+            best = sorted(doc_ids, key=scores.__getitem__, reverse=True)[:k]
+        return [(doc_id, scores[doc_id]) for doc_id in best]
+
+    def reset(self):
+        if len(self.touched) > self.num_docs // 16:
+            self.scores = array("d", bytes(8 * self.num_docs))
+            self.seen = bytearray(self.num_docs)
+        else:
+            scores = self.scores
+            seen = self.seen
+            for doc_id in self.touched:
+                scores[doc_id] = 0
+                seen[doc_id] = 0
+        self.touched = []
+
+
+class NumpyAccumulators:
+    """
+    The same accumulators with NumPy: the BM25 contributions of a whole
+    posting list are computed in one expression and scatter-added into the
+    score array. The arithmetic is the same as in the Python accumulators,
+    so the scores and the ranking are identical.
+    """
+
+    def __init__(self, num_docs):
+        self.num_docs = num_docs
+        self.scores = np.zeros(num_docs)
+        self.seen = np.zeros(num_docs, dtype=bool)
+        self.touched = []
+
+    def add_term(self, inverted_index, term_id, idf, length_norms):
+        if isinstance(inverted_index, CachedPostingsReader):
+            # cached lists are already decoded, and an array("I") is read without copying it
+            postings = np.frombuffer(inverted_index.postings(term_id), dtype=np.uint32)
+            self.add_arrays(postings[0::2], postings[1::2], idf, length_norms)
+            return
+        arrays = [decode_postings_arrays(data) for data in inverted_index.encoded_lists(term_id) if data]
+        if arrays:
+            self.add_arrays(np.concatenate([doc_ids for doc_ids, _ in arrays]), np.concatenate([frequencies for _, frequencies in arrays]), idf, length_norms)
+
+    def add_postings(self, postings, idf, length_norms):
+        postings = np.array(postings, dtype=np.int64)
+        self.add_arrays(postings[0::2], postings[1::2], idf, length_norms)
+
+    def add_arrays(self, doc_ids, frequencies, idf, length_norms):
+        new_doc_ids = doc_ids[~self.seen[doc_ids]]
+        self.seen[new_doc_ids] = True
+        self.touched.append(new_doc_ids)
+        # doc ids are unique within a posting list, so a plain fancy-indexed add is a scatter-add
+        self.scores[doc_ids] += idf * (frequencies / (frequencies + np.frombuffer(length_norms, dtype=np.float64)[doc_ids]))
+
+    def top_k(self, k, allowed=None):
+        """
+        Returns the k best (doc_id, score) pairs, in the same order as sorting
+        all of them by score: the k-th best score is found with a partition,
+        and documents tied with it are taken in the order they were first scored.
+        """
+        doc_ids = np.concatenate(self.touched) if self.touched else np.zeros(0, dtype=np.int64)
+        if allowed is not None:
+            doc_ids = doc_ids[np.isin(doc_ids, np.fromiter(allowed, dtype=np.int64, count=len(allowed)))]
+        scores = self.scores[doc_ids]
+        selected = np.arange(len(doc_ids))
+        if k < len(doc_ids):
+            kth_score = np.partition(scores, len(scores) - k)[len(scores) - k]
+            greater = selected[scores > kth_score]
+            tied = selected[scores == kth_score][:k - len(greater)]
+            selected = np.sort(np.concatenate((greater, tied)))
+        best = selected[np.argsort(-scores[selected], kind="stable")]
+        return [(int(doc_ids[i]), float(scores[i])) for i in best]
+
+    def reset(self):
+        if sum(len(doc_ids) for doc_ids in self.touched) > self.num_docs // 16:
+            self.scores = np.zeros(self.num_docs)
+            self.seen = np.zeros(self.num_docs, dtype=bool)
+        else:
+            for doc_ids in self.touched:
+                self.scores[doc_ids] = 0
+                self.seen[doc_ids] = False
+        self.touched = []
+
+
+def create_accumulators(num_docs, backend="auto"):
+    """
+    Returns NumpyAccumulators for the numpy backend, or for auto when NumPy is
+    installed, and the array based Accumulators otherwise.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown scoring backend '{backend}', expected one of {', '.join(BACKENDS)}")
+    if backend == "numpy" and np is None:
+        raise ValueError("The numpy scoring backend needs NumPy to be installed")
+    if backend == "python" or np is None:
+        return Accumulators(num_docs)
+    return NumpyAccumulators(num_docs)
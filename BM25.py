@@ -1,99 +1,129 @@
 import json
+import heapq
 import argparse
-from IndexEngine import TokenizeStrings
-from math import log
+from functools import partial
+from IndexEngine import TokenizeStrings, CachedStemmer
 import os
 from objects import RetrievalTestingOutput, RetrievalOutput
-from PorterStemmer import PorterStemmer
-
-def bm_25(k1=1.2, b=0.75, top_retrieved = 1000, use_stemming=False, testing = True, **kwargs):
+from BinaryIndex import open_inverted_index
+from Positions import open_positions, split_phrases, find_phrase_matches
+from CollectionStats import load_collection_stats
+from ImpactIndex import open_impact_index
+from Accumulators import create_accumulators, BACKENDS
+from BatchEvaluation import evaluate_topics
+from PostingsCache import cache_postings
+from LexiconStore import open_lexicon
+
+MODES = ("exhaustive", "impact")
+
+def bm_25(k1=1.2, b=0.75, top_retrieved = 1000, use_stemming=False, testing = True, mode="exhaustive", **kwargs):
     if testing and (not os.path.exists(kwargs["directory_path"]) or not os.path.exists(kwargs["queries_path"])):
         raise ValueError("Please provide a valid path to the contents being retrieved")
+    if mode not in MODES:
+        raise ValueError(f"Unknown BM25 mode '{mode}', expected one of {', '.join(MODES)}")
     
-    ps = PorterStemmer() if use_stemming else None
-    queries = read_json(kwargs["queries_path"]) if testing else kwargs["queries"]
-    lexicon = read_json(os.path.join(kwargs["directory_path"], "lexicon.json")) if testing else kwargs["lexicon"]
-    inverted_index = read_json(os.path.join(kwargs["directory_path"], "inverted-index.json")) if testing else kwargs["inverted_index"]
-    mapping_to_docno = read_json("mapping.json")["doc_nos"] if testing else kwargs["mapping_to_docno"]
-    doc_lengths = read_doc_lengths(os.path.join(kwargs["directory_path"], "doc-lengths.txt")) if testing else kwargs["doc_lengths"]
-    N = len(doc_lengths)
-    avdl = sum(doc_lengths.values()) / N
-    
-    list_output = []
+    budget = {"max_postings": kwargs.get("max_postings"), "time_budget_ms": kwargs.get("time_budget_ms")}
 
     if testing:
-        for topic_number, query_text in queries.items():
-            tokens = []
-            TokenizeStrings(query_text.split(" "), tokens)
-            if ps:
-                tokens[:] = [ps.stem(token, 0, len(token) - 1) for token in tokens]
-            
-            scores = {}
-            for token in tokens:
-                if token not in lexicon:
-                    continue
-                token_id = lexicon[token]
-                postings = inverted_index[str(token_id)]
-                ni = len(postings) // 2  
-
-                for i in range(0, len(postings), 2):
-                    doc_id = postings[i]
-                    fi = postings[i + 1] 
-                    dl = doc_lengths[str(doc_id)]
-                    score = bm_25_score(fi, N, ni, dl, avdl, k1, b)
-                    if doc_id not in scores:
-                        scores[doc_id] = 0
-                    scores[doc_id] += score
-
-            ranked_docs = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:top_retrieved] 
-            for rank, (doc_id, score) in enumerate(ranked_docs):
-                list_output.append(RetrievalTestingOutput(topic_number, mapping_to_docno[doc_id], rank + 1, score))
-
-        write_to_txt(list_output, kwargs["file_output"])
+        queries = read_json(kwargs["queries_path"])
+        postings_cache_bytes = int(kwargs.get("postings_cache_mb", 0) * 1024 * 1024)
+        load_args = (kwargs["directory_path"], k1, b, top_retrieved, use_stemming, mode, kwargs.get("backend", "auto"), budget, postings_cache_bytes, kwargs.get("warm_up"))
+        state = load_ranking_state(*load_args)
+        mapping_to_docno = read_json("mapping.json")["doc_nos"]
+        rankings = evaluate_topics(queries, rank_query, state, load_ranking_state, load_args, kwargs.get("workers", 1))
+        write_to_txt((RetrievalTestingOutput(topic_number, mapping_to_docno[doc_id], rank + 1, score)
+                      for topic_number, ranked_docs in rankings
+                      for rank, (doc_id, score) in enumerate(ranked_docs)), kwargs["file_output"])
     else:
-        tokens = []
-        TokenizeStrings(queries.split(" "), tokens)
-        if ps:
-            tokens[:] = [ps.stem(token, 0, len(token) - 1) for token in tokens]
-        
-        scores = {}
-        for token in tokens:
-            if token not in lexicon:
-                continue
-            token_id = lexicon[token]
-            postings = inverted_index[str(token_id)]
-            ni = len(postings) // 2  
-
-            for i in range(0, len(postings), 2):
-                doc_id = postings[i]
-                fi = postings[i + 1] 
-                dl = doc_lengths[str(doc_id)]
-                score = bm_25_score(fi, N, ni, dl, avdl, k1, b)
-                if doc_id not in scores:
-                    scores[doc_id] = 0
-                scores[doc_id] += score
-
-        ranked_docs = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:top_retrieved] 
+        ps = (kwargs.get("stemmer") or CachedStemmer()) if use_stemming else None
+        state = ranking_state(kwargs["lexicon"], kwargs["inverted_index"], kwargs["stats"].with_parameters(k1, b), top_retrieved, mode, ps, kwargs.get("positions"), kwargs.get("impacts"), kwargs.get("backend", "auto"), budget)
+        metadata = kwargs["metadata"]
+        ranked_docs = rank_query(kwargs["queries"], **state)
+        list_output = []
         for rank, (doc_id, score) in enumerate(ranked_docs):
-            meta_data = read_json(os.path.join("IndexEngine","MetaData",mapping_to_docno[doc_id]+".json"))
-            list_output.append(RetrievalOutput(rank+1, meta_data["headline"], meta_data["date"], mapping_to_docno[doc_id]))
+            list_output.append(RetrievalOutput(rank+1, metadata.headline(doc_id), metadata.date(doc_id), metadata.docno(doc_id)))
         return list_output
 
 
-
-def read_doc_lengths(file_path):
-    doc_lengths = {}
-    with open(file_path, 'r') as file:
-        for idx, line in enumerate(file, start=1):
-            doc_lengths[str(idx-1)] = int(line.strip()) 
-    return doc_lengths
-
-
-def bm_25_score(fi, N, ni, dl, avdl, k1, b):
-    K = k1 * ((1 - b) + b * (dl / avdl))
-    frequency_saturation = fi / (fi + K)
-    idf = log((N - ni + 0.5) / (ni + 0.5))
-    return idf * frequency_saturation
+def load_ranking_state(directory_path, k1, b, top_retrieved, use_stemming, mode, backend, budget, postings_cache_bytes=0, warm_up=None):
+    """
+    Opens the index in directory_path and returns the keyword arguments of rank_query.
+    With postings_cache_bytes, decoded posting lists are cached, warmed up
+    with the terms of the warm_up query log if given.
+    """
+    lexicon = open_lexicon(directory_path)
+    inverted_index = open_inverted_index(directory_path)
+    stats = load_collection_stats(directory_path, inverted_index, k1, b)
+    impacts = open_impact_index(directory_path) if mode == "impact" else None
+    ps = CachedStemmer() if use_stemming else None
+    inverted_index = cache_postings(inverted_index, postings_cache_bytes, lexicon, partial(tokenize_query, ps=ps), warm_up)
+    return ranking_state(lexicon, inverted_index, stats, top_retrieved, mode, ps, open_positions(directory_path), impacts, backend, budget)
+
+
+def ranking_state(lexicon, inverted_index, stats, top_retrieved, mode, ps, positions, impacts, backend, budget):
+    if mode == "impact":
+        if impacts is None:
+            raise ValueError("The impact mode needs an index built with --impacts")
+        if (impacts.k1, impacts.b) != (stats.k1, stats.b):
+            raise ValueError(f"The impact index was built with k1={impacts.k1} and b={impacts.b}")
+    accumulators = create_accumulators(stats.N, backend) if mode == "exhaustive" else None
+    return {"lexicon": lexicon, "inverted_index": inverted_index, "stats": stats, "top_retrieved": top_retrieved, "mode": mode,
+            "ps": ps, "positions": positions, "impacts": impacts, "accumulators": accumulators, **budget}
+
+
+def tokenize_query(query_text, ps=None):
+    tokens = []
+    TokenizeStrings(query_text.split(" "), tokens)
+    if ps:
+        tokens[:] = [ps.stem(token, 0, len(token) - 1) for token in tokens]
+    return tokens
+
+
+def rank_query(query_text, lexicon, inverted_index, stats, top_retrieved, mode="exhaustive", ps=None, positions=None, impacts=None, accumulators=None, **budget):
+    """
+    Returns the top [(doc_id, score), ...] of the query.
+    """
+    tokens = tokenize_query(query_text, ps)
+    term_ids = [lexicon[token] for token in tokens if token in lexicon]
+    matches = phrase_matches(query_text, lexicon, inverted_index, positions, ps) if positions else None
+    if mode == "impact":
+        scores, _ = impacts.score(term_ids, budget.get("max_postings"), budget.get("time_budget_ms"))
+        items = scores.items() if matches is None else [item for item in scores.items() if item[0] in matches]
+        return heapq.nlargest(top_retrieved, items, key=lambda x: x[1])
+
+    if accumulators is None:
+        accumulators = create_accumulators(stats.N)
+    score_tokens(term_ids, inverted_index, stats, accumulators)
+    ranked_docs = accumulators.top_k(top_retrieved, matches)
+    accumulators.reset()
+    return ranked_docs
+
+
+def score_tokens(term_ids, inverted_index, stats, accumulators):
+    """
+    Adds idf * fi / (fi + K) for every posting of the query terms, with the
+    idf of the term and the K of every document from the precomputed
+    collection statistics.
+    """
+    for term_id in term_ids:
+        accumulators.add_term(inverted_index, term_id, stats.idf[term_id], stats.length_norms)
+
+
+def phrase_matches(query_text, lexicon, inverted_index, positions, ps=None):
+    """
+    Returns the set of doc ids containing every "quoted phrase" of the query,
+    or None if the query has no phrases.
+    """
+    matches = None
+    for phrase in split_phrases(query_text):
+        phrase_tokens = tokenize_query(phrase, ps)
+        if not phrase_tokens:
+            continue
+        if any(token not in lexicon for token in phrase_tokens):
+            return set()
+        phrase_docs = find_phrase_matches([lexicon[token] for token in phrase_tokens], inverted_index, positions)
+        matches = phrase_docs if matches is None else matches & phrase_docs
+    return matches
 
 
 def write_to_txt(list_output, file_output):
@@ -124,6 +154,24 @@ if __name__ == "__main__":
                         help='Path to the output file where results will be stored.')
     parser.add_argument('--use_stemming', action='store_true',
                         help='If set, the query will be stemmed using Porter Stemmer.')
+    parser.add_argument('--k1', type=float, default=1.2,
+                        help='BM25 k1.')
+    parser.add_argument('--b', type=float, default=0.75,
+                        help='BM25 b.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes the topics are ranked in. The index is loaded once and shared with them.')
+    parser.add_argument('--mode', choices=MODES, default="exhaustive",
+                        help='exhaustive scores every posting, impact ranks on the impact ordered index (built with --impacts).')
+    parser.add_argument('--backend', choices=BACKENDS, default="auto",
+                        help='exhaustive mode only: score with NumPy (numpy), plain Python (python), or NumPy when it is installed (auto).')
+    parser.add_argument('--max_postings', type=int, default=None,
+                        help='impact mode only: maximum number of postings processed per query.')
+    parser.add_argument('--time_budget_ms', type=float, default=None,
+                        help='impact mode only: time budget per query in milliseconds.')
+    parser.add_argument('--postings_cache_mb', type=float, default=0,
+                        help='If set, decoded posting lists are kept in a cache of this many MB.')
+    parser.add_argument('--warm_up', type=str, default=None,
+                        help='Queries JSON file whose most frequent terms are loaded into the posting list cache before ranking.')
 
     args = parser.parse_args()
 
@@ -136,6 +184,6 @@ if __name__ == "__main__":
             "python bm25.py /home/smucker/latimes-index queries.txt hw2-results-WatIAMUserID.txt" 
         )
 
-    bm_25(directory_path = args.directory_path, queries_path = args.queries_path, file_output = args.file_output, k1=1.2, b=0.75, use_stemming=args.use_stemming)
+    bm_25(directory_path = args.directory_path, queries_path = args.queries_path, file_output = args.file_output, k1=args.k1, b=args.b, use_stemming=args.use_stemming, workers=args.workers, mode=args.mode, backend=args.backend, max_postings=args.max_postings, time_budget_ms=args.time_budget_ms, postings_cache_mb=args.postings_cache_mb, warm_up=args.warm_up)
 
 
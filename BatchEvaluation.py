@@ -0,0 +1,45 @@
+from functools import partial
+from multiprocessing import Pool
+
+worker_state = None
+
+
+def init_topic_worker(load_state, load_args):
+    global worker_state
+    # forked workers inherit the state the parent loaded, others load it themselves
+    if worker_state is None:
+        worker_state = load_state(*load_args)
+
+
+def rank_topic(rank, topic):
+    topic_number, query_text = topic
+    return topic_number, rank(query_text, **worker_state)
+
+
+def evaluate_topics(queries, rank, state, load_state, load_args, workers=1):
+    """
+    Yields (topic_number, rank(query_text, **state)) for every topic, in topic
+    order. With more than one worker the topics are ranked in a process pool;
+    the state (index readers, lexicon, ...) loaded by the parent is shared with
+    the workers when they are forked, and loaded with load_state(*load_args)
+    in each worker otherwise.
+
+    Parameters:
+    - queries: The {topic_number: query_text} dictionary.
+    - rank: A module level function taking the query text and the state as keyword arguments.
+    - state: The keyword arguments of rank, already loaded by the caller.
+    - load_state: A module level function returning the state from load_args.
+    - workers: Number of processes used.
+    """
+    global worker_state
+    if workers <= 1:
+        for topic_number, query_text in queries.items():
+            yield topic_number, rank(query_text, **state)
+        return
+
+    worker_state = state
+    try:
+        with Pool(workers, initializer=init_topic_worker, initargs=(load_state, load_args)) as pool:
+            yield from pool.imap(partial(rank_topic, rank), queries.items())
+    finally:
+        worker_state = None
@@ -0,0 +1,670 @@
+import os
+import json
+import mmap
+import argparse
+import heapq
+import struct
+from bisect import bisect_left
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+POSTINGS_FILE = "postings.bin"
+MANIFEST_FILE = "segments.json"
+MAGIC = b"PSTNGS01"
+POSITIONS_MAGIC = b"POSITNS1"
+SKIPS_MAGIC = b"SKIPS001"
+# postings per skip block, lists of at most this many postings have no skips
+SKIP_INTERVAL = 128
+TRAILER = struct.Struct("<8sQQ")
+RUN_ENTRY = struct.Struct("<II")
+
+
+def encode_vbyte(number, out):
+    while number >= 128:
+        out.append((number & 127) | 128)
+        number >>= 7
+    out.append(number)
+
+
+def read_vbyte(data, offset):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        if byte & 128:
+            value |= (byte & 127) << shift
+            shift += 7
+        else:
+            return value | (byte << shift), offset
+
+
+def encode_postings(postings):
+    """
+    Encodes an interleaved [doc_id, count, doc_id, count, ...] list as
+    variable-byte (doc id gap, count) pairs.
+    """
+    out = bytearray()
+    previous = 0
+    for i in range(0, len(postings), 2):
+        doc_id = postings[i]
+        encode_vbyte(doc_id - previous, out)
+        encode_vbyte(postings[i + 1], out)
+        previous = doc_id
+    return out
+
+
+def decode_postings(data):
+    postings = []
+    doc_id = 0
+    value = 0
+    shift = 0
+    is_doc_id = True
+    for byte in data:
+        if byte & 128:
+            value |= (byte & 127) << shift
+            shift += 7
+            continue
+        value |= byte << shift
+        if is_doc_id:
+            doc_id += value
+            postings.append(doc_id)
+        else:
+            postings.append(value)
+        is_doc_id = not is_doc_id
+        value = 0
+        shift = 0
+    return postings
+
+
+def decode_postings_arrays(data):
+    """
+    Decodes a variable-byte posting list into (doc_ids, frequencies) arrays
+    without a Python loop: every byte below 128 ends a value, so the values
+    are the sums of the 7-bit payloads of their bytes shifted by their place.
+    """
+    encoded = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(encoded < 128)
+    starts = np.zeros_like(ends)
+    starts[1:] = ends[:-1] + 1
+    shifts = (np.arange(len(encoded)) - np.repeat(starts, ends - starts + 1)) * 7
+    values = np.add.reduceat((encoded & 127).astype(np.int64) << shifts, starts)
+    return np.cumsum(values[0::2]), values[1::2]
+
+
+def positions_file_for(segment_file):
+    return segment_file.replace("postings", "positions", 1)
+
+
+def skips_file_for(segment_file):
+    return segment_file.replace("postings", "skips", 1)
+
+
+def encode_skips(data):
+    """
+    Splits an encoded posting list into blocks of SKIP_INTERVAL postings and
+    returns the last doc id and the byte offset of every block, as two
+    uint32 arrays. A block can be decoded on its own from its offset, with
+    the last doc id of the previous block as the base of its gaps.
+    """
+    if np is not None:
+        doc_ids, _ = decode_postings_arrays(data)
+        ends = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) < 128)
+        # posting p starts after the last byte of the count of posting p - 1
+        block_starts = np.concatenate(([0], ends[2 * SKIP_INTERVAL - 1::2 * SKIP_INTERVAL][:(len(doc_ids) - 1) // SKIP_INTERVAL] + 1))
+        last_doc_ids = np.append(doc_ids[SKIP_INTERVAL - 1:-1:SKIP_INTERVAL], doc_ids[-1])
+        return array("I", last_doc_ids.astype(np.uint32).tobytes()) + array("I", block_starts.astype(np.uint32).tobytes())
+    last_doc_ids = array("I")
+    block_starts = array("I")
+    doc_id = 0
+    offset = 0
+    num_postings = 0
+    while offset < len(data):
+        if num_postings % SKIP_INTERVAL == 0:
+            if num_postings:
+                last_doc_ids.append(doc_id)
+            block_starts.append(offset)
+        gap, offset = read_vbyte(data, offset)
+        _, offset = read_vbyte(data, offset)
+        doc_id += gap
+        num_postings += 1
+    last_doc_ids.append(doc_id)
+    return last_doc_ids + block_starts
+
+
+def write_skips(directory_path, segment_file):
+    """
+    Writes the skip blocks of every posting list of a segment longer than
+    SKIP_INTERVAL to its skips file, which lets an intersection jump to the
+    block holding a doc id instead of decoding the whole list. The file is
+    written next to the old one and replaces it, like the merged postings.
+    """
+    reader = PostingsReader(os.path.join(directory_path, segment_file))
+    skips_path = os.path.join(directory_path, skips_file_for(segment_file))
+    with PostingsWriter(skips_path + ".tmp", magic=SKIPS_MAGIC) as writer:
+        for term_id in range(len(reader)):
+            if reader.doc_frequency(term_id) <= SKIP_INTERVAL:
+                writer.add_encoded(b"", 0)
+                continue
+            skips = encode_skips(reader.encoded(term_id))
+            writer.add_encoded(skips.tobytes(), len(skips) // 2)
+    reader.close()
+    os.replace(skips_path + ".tmp", skips_path)
+
+
+def remove_skips(directory_path, segment_file):
+    skips_path = os.path.join(directory_path, skips_file_for(segment_file))
+    if os.path.exists(skips_path):
+        os.remove(skips_path)
+
+
+class PostingsWriter:
+    """
+    Streams posting lists to disk in term id order. The term id -> offset
+    directory and the document frequencies are written as a footer on close.
+    """
+
+    def __init__(self, path, magic=MAGIC):
+        self.file = open(path, "wb")
+        self.magic = magic
+        self.offsets = array("Q", [0])
+        self.doc_frequencies = array("I")
+        self.position = 0
+
+    def add(self, postings):
+        self.add_encoded(encode_postings(postings), len(postings) // 2)
+
+    def add_encoded(self, data, doc_frequency):
+        self.file.write(data)
+        self.position += len(data)
+        self.offsets.append(self.position)
+        self.doc_frequencies.append(doc_frequency)
+
+    def close(self):
+        padding = -self.position % 8
+        self.file.write(b"\0" * padding)
+        footer_offset = self.position + padding
+        self.offsets.tofile(self.file)
+        self.doc_frequencies.tofile(self.file)
+        self.file.write(TRAILER.pack(self.magic, len(self.doc_frequencies), footer_offset))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+
+
+def write_inverted_index(inverted_index, num_terms, path):
+    with PostingsWriter(path) as writer:
+        for term_id in range(num_terms):
+            writer.add(inverted_index.get(term_id, []))
+
+
+def write_run(inverted_index, path):
+    """
+    Writes a partial inverted index to disk sorted by term id. Each entry is a
+    (term_id, byte length) header followed by the encoded posting list.
+    """
+    with open(path, "wb") as file:
+        for term_id in sorted(inverted_index):
+            data = encode_postings(inverted_index[term_id])
+            file.write(RUN_ENTRY.pack(term_id, len(data)))
+            file.write(data)
+
+
+def write_encoded_run(encoded_index, path):
+    with open(path, "wb") as file:
+        for term_id in sorted(encoded_index):
+            data = encoded_index[term_id]
+            file.write(RUN_ENTRY.pack(term_id, len(data)))
+            file.write(data)
+
+
+def read_run(path, run_number):
+    with open(path, "rb") as file:
+        while True:
+            header = file.read(RUN_ENTRY.size)
+            if not header:
+                break
+            term_id, length = RUN_ENTRY.unpack(header)
+            yield term_id, run_number, file.read(length)
+
+
+def merge_run_entries(run_paths):
+    """
+    K-way merges sorted runs, yielding each term id with the list of its encoded
+    entries in run order. Runs are written in document order, so concatenating
+    a term's entries in run order keeps its postings sorted.
+    """
+    runs = [read_run(run_path, run_number) for run_number, run_path in enumerate(run_paths)]
+    current_term_id = None
+    entries = []
+    for term_id, _, data in heapq.merge(*runs):
+        if term_id != current_term_id and entries:
+            yield current_term_id, entries
+            entries = []
+        current_term_id = term_id
+        entries.append(data)
+    if entries:
+        yield current_term_id, entries
+
+
+def merge_runs(run_paths, num_terms, path):
+    with PostingsWriter(path) as writer:
+        next_term_id = 0
+        for term_id, entries in merge_run_entries(run_paths):
+            while next_term_id < term_id:
+                writer.add([])
+                next_term_id += 1
+            postings = []
+            for data in entries:
+                postings.extend(decode_postings(data))
+            writer.add(postings)
+            next_term_id += 1
+        while next_term_id < num_terms:
+            writer.add([])
+            next_term_id += 1
+
+
+class PostingsReader:
+    """
+    Memory-maps a postings file and decodes a posting list only when it is
+    requested. Lists are returned in the interleaved [doc_id, count, ...] form.
+    """
+
+    def __init__(self, path, magic=MAGIC):
+        if not os.path.exists(path):
+            raise ValueError(f"No postings file found at {path}")
+        self.file = open(path, "rb")
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        file_magic, self.num_terms, footer_offset = TRAILER.unpack_from(self.buffer, len(self.buffer) - TRAILER.size)
+        if file_magic != magic:
+            raise ValueError(f"{path} is not a {magic.decode()} file")
+        self.view = memoryview(self.buffer)
+        df_offset = footer_offset + (self.num_terms + 1) * 8
+        self.offsets = self.view[footer_offset:df_offset].cast("Q")
+        self.doc_frequencies = self.view[df_offset:df_offset + self.num_terms * 4].cast("I")
+
+    def __len__(self):
+        return self.num_terms
+
+    def doc_frequency(self, term_id):
+        if term_id >= self.num_terms:
+            return 0
+        return self.doc_frequencies[term_id]
+
+    def encoded(self, term_id):
+        if term_id >= self.num_terms:
+            return b""
+        return self.buffer[self.offsets[term_id]:self.offsets[term_id + 1]]
+
+    def encoded_view(self, term_id):
+        """
+        The encoded list as a view of the mapped file, without copying it.
+        """
+        if term_id >= self.num_terms:
+            return self.view[0:0]
+        return self.view[self.offsets[term_id]:self.offsets[term_id + 1]]
+
+    def encoded_range(self, first_term_id, last_term_id):
+        """
+        The encoded lists of the terms first_term_id to last_term_id - 1,
+        which are stored one after the other.
+        """
+        return self.buffer[self.offsets[first_term_id]:self.offsets[last_term_id]]
+
+    def postings(self, term_id):
+        return decode_postings(self.encoded(term_id))
+
+    def encoded_lists(self, term_id):
+        return [self.encoded(term_id)]
+
+    def close(self):
+        self.offsets.release()
+        self.doc_frequencies.release()
+        self.view.release()
+        self.buffer.close()
+        self.file.close()
+
+
+class SegmentedPostingsReader:
+    """
+    Reads an index made of several postings files. Segments hold consecutive
+    document id ranges, so a term's posting list is the concatenation of its
+    lists in segment order. Older segments simply have fewer terms.
+    """
+
+    def __init__(self, readers):
+        self.readers = readers
+        self.num_terms = max(len(reader) for reader in readers)
+
+    def __len__(self):
+        return self.num_terms
+
+    def doc_frequency(self, term_id):
+        return sum(reader.doc_frequency(term_id) for reader in self.readers)
+
+    def postings(self, term_id):
+        postings = []
+        for reader in self.readers:
+            postings.extend(reader.postings(term_id))
+        return postings
+
+    def encoded_lists(self, term_id):
+        """
+        Returns the encoded list of the term in every segment. Each list is gap
+        encoded on its own, starting from doc id 0.
+        """
+        return [reader.encoded(term_id) for reader in self.readers]
+
+    def close(self):
+        for reader in self.readers:
+            reader.close()
+
+
+class SkipCursor:
+    """
+    Forward-only cursor over the doc ids of a term's posting list in every
+    segment. next_geq finds the block holding the target with a binary
+    search over the block skips and decodes only that block, so a cursor
+    moved to a few doc ids reads a few blocks of the list. Lists without
+    skips are decoded as a single block.
+    """
+
+    def __init__(self, segment_lists):
+        # [(encoded list, last doc ids of its blocks, block offsets), ...] in segment order
+        self.segment_lists = segment_lists
+        self.segment = 0
+        self.block = 0
+        self.postings = []
+        self.doc_ids = []
+        self.index = 0
+
+    def next_geq(self, target):
+        """
+        Returns the first doc id >= target at or after the cursor, or None when
+        there is none.
+        """
+        if self.index < len(self.doc_ids) and self.doc_ids[-1] >= target:
+            self.index = bisect_left(self.doc_ids, target, self.index)
+            return self.doc_ids[self.index]
+        while self.segment < len(self.segment_lists):
+            data, last_doc_ids, block_starts = self.segment_lists[self.segment]
+            if last_doc_ids is None:
+                if not self.doc_ids:
+                    self.postings = decode_postings(data)
+                    self.doc_ids = self.postings[0::2]
+                if self.doc_ids[-1] >= target:
+                    self.index = bisect_left(self.doc_ids, target, self.index)
+                    return self.doc_ids[self.index]
+            elif last_doc_ids[-1] >= target:
+                block = bisect_left(last_doc_ids, target, self.block)
+                if block != self.block or not self.doc_ids:
+                    self.decode_block(data, last_doc_ids, block_starts, block)
+                self.index = bisect_left(self.doc_ids, target, self.index)
+                return self.doc_ids[self.index]
+            self.segment += 1
+            self.block = 0
+            self.postings = []
+            self.doc_ids = []
+            self.index = 0
+        return None
+
+    def frequency(self):
+        """
+        Returns the count of the doc id the cursor is on.
+        """
+        return self.postings[2 * self.index + 1]
+
+    def decode_block(self, data, last_doc_ids, block_starts, block):
+        base = last_doc_ids[block - 1] if block else 0
+        end = block_starts[block + 1] if block + 1 < len(block_starts) else len(data)
+        self.block = block
+        self.postings = decode_postings(data[block_starts[block]:end])
+        self.doc_ids = [base + doc_id for doc_id in self.postings[0::2]]
+        self.index = 0
+
+
+class GallopingCursor:
+    """
+    Forward-only cursor over the doc ids of a decoded [doc_id, count, ...]
+    list. next_geq gallops ahead 1, 2, 4, ... postings until it passes the
+    target, then binary searches the last step, so a move costs the log of
+    the number of postings skipped.
+    """
+
+    def __init__(self, postings):
+        self.postings = postings
+        self.num_postings = len(postings) // 2
+        self.index = 0
+
+    def next_geq(self, target):
+        postings = self.postings
+        low = self.index
+        if low >= self.num_postings:
+            return None
+        if postings[2 * low] >= target:
+            return postings[2 * low]
+        step = 1
+        high = low + step
+        while high < self.num_postings and postings[2 * high] < target:
+            low = high
+            step *= 2
+            high = low + step
+        high = min(high, self.num_postings)
+        # the doc id at low is below the target, the one at high (if any) is not
+        while high - low > 1:
+            middle = (low + high) // 2
+            if postings[2 * middle] < target:
+                low = middle
+            else:
+                high = middle
+        self.index = high
+        return postings[2 * high] if high < self.num_postings else None
+
+    def frequency(self):
+        """
+        Returns the count of the doc id the cursor is on.
+        """
+        return self.postings[2 * self.index + 1]
+
+
+class SkipLists:
+    """
+    The postings and skips files of every segment of an index, opened side by
+    side to give skipping cursors over posting lists.
+    """
+
+    def __init__(self, directory_path, segments):
+        self.postings_readers = [PostingsReader(os.path.join(directory_path, segment)) for segment in segments]
+        self.skip_readers = [PostingsReader(os.path.join(directory_path, skips_file_for(segment)), magic=SKIPS_MAGIC) for segment in segments]
+
+    def cursor(self, term_id):
+        segment_lists = []
+        for postings_reader, skip_reader in zip(self.postings_readers, self.skip_readers):
+            data = postings_reader.encoded_view(term_id)
+            if not data:
+                continue
+            num_blocks = skip_reader.doc_frequency(term_id)
+            if num_blocks:
+                skips = skip_reader.encoded_view(term_id).cast("I")
+                segment_lists.append((data, skips[:num_blocks], skips[num_blocks:]))
+            else:
+                segment_lists.append((data, None, None))
+        return SkipCursor(segment_lists)
+
+    def close(self):
+        for reader in self.postings_readers + self.skip_readers:
+            reader.close()
+
+
+def open_skip_lists(directory_path):
+    """
+    Returns the skip lists of the index, or None when a segment has no skips
+    file, as in indexes built before skips were written.
+    """
+    segments = read_manifest(directory_path)["segments"] if os.path.exists(os.path.join(directory_path, MANIFEST_FILE)) else [POSTINGS_FILE]
+    if not all(os.path.exists(os.path.join(directory_path, skips_file_for(segment))) for segment in segments):
+        return None
+    return SkipLists(directory_path, segments)
+
+
+def read_manifest(directory_path):
+    manifest_path = os.path.join(directory_path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        raise ValueError(f"No segment manifest found in {directory_path}")
+    with open(manifest_path, "r") as file:
+        return json.load(file)
+
+
+def write_manifest(directory_path, manifest):
+    # replaced rather than rewritten, running engines read it before every query
+    manifest_path = os.path.join(directory_path, MANIFEST_FILE)
+    with open(manifest_path + ".tmp", "w") as file:
+        json.dump(manifest, file, indent=4)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def open_inverted_index(directory_path):
+    if not os.path.exists(os.path.join(directory_path, MANIFEST_FILE)):
+        return PostingsReader(os.path.join(directory_path, POSTINGS_FILE))
+    segments = read_manifest(directory_path)["segments"]
+    if len(segments) == 1:
+        return PostingsReader(os.path.join(directory_path, segments[0]))
+    return SegmentedPostingsReader([PostingsReader(os.path.join(directory_path, segment)) for segment in segments])
+
+
+def merge_segments(directory_path):
+    """
+    Rewrites all segments of an index into a single postings.bin.
+    """
+    manifest = read_manifest(directory_path)
+    segments = manifest["segments"]
+    if len(segments) < 2:
+        return
+    reader = open_inverted_index(directory_path)
+    merged_path = os.path.join(directory_path, POSTINGS_FILE + ".tmp")
+    with PostingsWriter(merged_path) as writer:
+        for term_id in range(len(reader)):
+            writer.add(reader.postings(term_id))
+    reader.close()
+
+    if manifest.get("positions"):
+        position_readers = [PostingsReader(os.path.join(directory_path, positions_file_for(segment)), magic=POSITIONS_MAGIC) for segment in segments]
+        merged_positions_path = os.path.join(directory_path, positions_file_for(POSTINGS_FILE) + ".tmp")
+        with PostingsWriter(merged_positions_path, magic=POSITIONS_MAGIC) as writer:
+            for term_id in range(max(len(position_reader) for position_reader in position_readers)):
+                writer.add_encoded(b"".join(position_reader.encoded(term_id) for position_reader in position_readers), 0)
+        for position_reader in position_readers:
+            position_reader.close()
+        os.replace(merged_positions_path, os.path.join(directory_path, positions_file_for(POSTINGS_FILE)))
+
+    os.replace(merged_path, os.path.join(directory_path, POSTINGS_FILE))
+    write_skips(directory_path, POSTINGS_FILE)
+    manifest["segments"] = [POSTINGS_FILE]
+    manifest["version"] += 1
+    write_manifest(directory_path, manifest)
+    for segment in segments:
+        if segment != POSTINGS_FILE:
+            os.remove(os.path.join(directory_path, segment))
+            remove_skips(directory_path, segment)
+            if manifest.get("positions"):
+                os.remove(os.path.join(directory_path, positions_file_for(segment)))
+
+
+def posting_entry_offsets(data):
+    """
+    Returns the byte offset of every posting's entry in the length prefixed
+    positions of a term, followed by the end of the data.
+    """
+    offsets = [0]
+    offset = 0
+    while offset < len(data):
+        length, offset = read_vbyte(data, offset)
+        offset += length
+        offsets.append(offset)
+    return offsets
+
+
+def split_segments(directory_path, num_shards):
+    """
+    Rewrites all segments of an index into num_shards segments holding
+    consecutive, equally sized ranges of documents. Doc ids stay global, so
+    every segment is a shard that can be searched on its own with the
+    collection statistics of the whole index.
+    """
+    manifest = read_manifest(directory_path)
+    segments = manifest["segments"]
+    with open(os.path.join(directory_path, "doc-lengths.txt"), "r") as file:
+        num_docs = sum(1 for _ in file)
+    boundaries = [num_docs * shard // num_shards for shard in range(1, num_shards)]
+    shard_files = [f"postings-{shard:04d}.bin" for shard in range(num_shards)]
+
+    reader = open_inverted_index(directory_path)
+    writers = [PostingsWriter(os.path.join(directory_path, shard_file + ".tmp")) for shard_file in shard_files]
+    if manifest.get("positions"):
+        position_readers = [PostingsReader(os.path.join(directory_path, positions_file_for(segment)), magic=POSITIONS_MAGIC) for segment in segments]
+        position_writers = [PostingsWriter(os.path.join(directory_path, positions_file_for(shard_file) + ".tmp"), magic=POSITIONS_MAGIC) for shard_file in shard_files]
+    else:
+        position_readers = position_writers = []
+    for term_id in range(len(reader)):
+        postings = reader.postings(term_id)
+        doc_ids = postings[0::2]
+        cuts = [0] + [bisect_left(doc_ids, boundary) for boundary in boundaries] + [len(doc_ids)]
+        for shard, writer in enumerate(writers):
+            writer.add(postings[2 * cuts[shard]:2 * cuts[shard + 1]])
+        if position_writers:
+            data = b"".join(position_reader.encoded(term_id) for position_reader in position_readers)
+            entry_offsets = posting_entry_offsets(data)
+            for shard, writer in enumerate(position_writers):
+                writer.add_encoded(data[entry_offsets[cuts[shard]]:entry_offsets[cuts[shard + 1]]], 0)
+    for writer in writers + position_writers:
+        writer.close()
+    reader.close()
+    for position_reader in position_readers:
+        position_reader.close()
+
+    for segment in segments:
+        os.remove(os.path.join(directory_path, segment))
+        remove_skips(directory_path, segment)
+        if manifest.get("positions"):
+            os.remove(os.path.join(directory_path, positions_file_for(segment)))
+    for shard_file in shard_files:
+        os.replace(os.path.join(directory_path, shard_file + ".tmp"), os.path.join(directory_path, shard_file))
+        if manifest.get("positions"):
+            os.replace(os.path.join(directory_path, positions_file_for(shard_file) + ".tmp"), os.path.join(directory_path, positions_file_for(shard_file)))
+        write_skips(directory_path, shard_file)
+    manifest["segments"] = shard_files
+    manifest["version"] += 1
+    write_manifest(directory_path, manifest)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Maintenance commands for the binary inverted index.')
+
+    subparsers = parser.add_subparsers(dest="command", help="Subcommand to run.")
+
+    parser_merge = subparsers.add_parser('merge-segments', help="Merge all segments of an index into one postings file.")
+    parser_merge.add_argument('directory_path', type=str, help="Path to the directory containing the index files.")
+
+    parser_split = subparsers.add_parser('split-segments', help="Split an index into segments of consecutive document ranges, one per shard.")
+    parser_split.add_argument('directory_path', type=str, help="Path to the directory containing the index files.")
+    parser_split.add_argument('num_shards', type=int, help="Number of shards.")
+
+    args = parser.parse_args()
+
+    if args.command == 'merge-segments':
+        merge_segments(args.directory_path)
+    elif args.command == 'split-segments':
+        split_segments(args.directory_path, args.num_shards)
+    else:
+        parser.print_help()
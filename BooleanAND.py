@@ -1,78 +1,114 @@
 import json
 import argparse
-from IndexEngine import TokenizeStrings
+from itertools import islice
 import os
 from objects import RetrievalTestingOutput
+from BinaryIndex import open_inverted_index, open_skip_lists
+from BooleanQuery import parse_boolean_query, conjunction_tokens, compile_query, matching_doc_ids, term_cursor
+from BatchEvaluation import evaluate_topics
+from PostingsCache import cache_postings
+from BM25 import tokenize_query
+from LexiconStore import open_lexicon
+from MetaDataStore import open_metadata_store
 
-def boolean_and(directory_path, queries_path, file_output):
+# a list is looked up with a cursor when it is more than this many times longer than the candidates
+SCAN_RATIO = 16
+
+def boolean_and(directory_path, queries_path, file_output, workers=1, postings_cache_mb=0, warm_up=None):
     if not os.path.exists(directory_path) or not os.path.exists(queries_path):
         raise ValueError("please provide a valid path to the contents being retrieved")
     
     queries = read_json(queries_path)
-    lexicon = read_json(os.path.join(directory_path, "lexicon.json"))
-    inverted_index = read_json(os.path.join(directory_path, "inverted-index.json"))
+    load_args = (directory_path, int(postings_cache_mb * 1024 * 1024), warm_up)
+    state = load_and_state(*load_args)
     mapping_to_docno =read_json("mapping.json")["doc_nos"]
-    list_output = []
-    
-    for topic_number, query_text in queries.items():
-        tokens = []
-        TokenizeStrings(query_text.split(" "), tokens)
-        postings_list = []
-        not_found = False
-        for token in tokens:
-            if token not in lexicon:
-                not_found = True
-                break
-            token_id = lexicon[token]
-            postings = inverted_index[str(token_id)]
-            postings_list.append(postings)
-        sorted_lists = sorted(postings_list, key=lambda x: len(x))
-        if not not_found:
-            intersection = merge_and_find_intersection_set(sorted_lists)
-            if intersection:
-                for i, docID in enumerate(intersection):
-                    list_output.append(RetrievalTestingOutput(topic_number, mapping_to_docno[docID], i+1, len(intersection)-(i+1)))
-        
-    write_to_txt(list_output, file_output)
-
-def merge_and_find_intersection_set(lists: list[list[int]]) -> list[int]:
-    if not lists:
-        return []
-    if len(lists) == 1:
-        return lists[0][::2]
-    
-    sets_of_docIDs = [set(lst[::2]) for lst in lists]
-    
-    intersection = set.intersection(*sets_of_docIDs)
-    
-    return list(sorted(intersection))
+    rankings = skip_malformed_topics(evaluate_topics(queries, topic_and_query, state, load_and_state, load_args, workers))
+
+    write_to_txt((RetrievalTestingOutput(topic_number, mapping_to_docno[docID], i+1, len(intersection)-(i+1))
+                  for topic_number, intersection in rankings
+                  for i, docID in enumerate(intersection)), file_output)
 
-def merge_and_find_intersection(lists: list[list[int]]) -> list[int]:
-    if not lists:
+def topic_and_query(query_text, **state):
+    """
+    and_query for the topics of a run: a query that cannot be parsed returns
+    its ValueError instead of raising it, so it does not end the run.
+    """
+    try:
+        return and_query(query_text, **state)
+    except ValueError as error:
+        return error
+
+def skip_malformed_topics(rankings):
+    """
+    Reports every topic whose query could not be parsed and gives it no results.
+    """
+    for topic_number, intersection in rankings:
+        if isinstance(intersection, ValueError):
+            print(f"Topic {topic_number} is skipped: {intersection}")
+            intersection = []
+        yield topic_number, intersection
+
+def load_and_state(directory_path, postings_cache_bytes=0, warm_up=None):
+    lexicon = open_lexicon(directory_path)
+    inverted_index = cache_postings(open_inverted_index(directory_path), postings_cache_bytes, lexicon, tokenize_query, warm_up)
+    return {"lexicon": lexicon, "inverted_index": inverted_index, "skip_lists": open_skip_lists(directory_path),
+            "num_docs": len(open_metadata_store(directory_path))}
+
+def and_query(query_text, lexicon, inverted_index, skip_lists=None, num_docs=0):
+    """
+    Returns the sorted doc ids of the documents matching a boolean query (see
+    BooleanQuery.py). A plain list of words matches the documents containing
+    every one of them and is answered by intersect_terms; other queries are
+    compiled into a tree of lazy iterators whose matches stream out in doc
+    id order, without building intermediate lists.
+    """
+    node = parse_boolean_query(query_text)
+    tokens = conjunction_tokens(node)
+    if tokens is None:
+        return list(matching_doc_ids(compile_query(node, lexicon, inverted_index, skip_lists, num_docs)))
+    return intersect_terms(tokens, lexicon, inverted_index, skip_lists)
+
+def intersect_terms(tokens, lexicon, inverted_index, skip_lists=None):
+    """
+    Returns the sorted doc ids of the documents containing every token.
+    The lists are intersected shortest first and only the shortest one is
+    decoded up front. The remaining candidates are looked up in every longer
+    list with a cursor that skips ahead, through the skip blocks of the
+    index when it has them, so a query mixing a rare and a common term costs
+    about as much as the rare term's list. A list that is not much longer
+    than the candidates is scanned in full instead, which is cheaper than
+    looking up most of its doc ids one by one.
+    """
+    term_ids = []
+    for token in tokens:
+        if token not in lexicon:
+            return []
+        term_ids.append(lexicon[token])
+    if not term_ids:
         return []
-    if len(lists) == 1:
-        return lists[0][::2]
-    intersection = lists[0][::2]
-    for current_list in lists:
-        intersection = intersection_of_2(intersection, current_list)
-        if not intersection:
-            return [] 
-    return intersection
+    term_ids = sorted(dict.fromkeys(term_ids), key=inverted_index.doc_frequency)
+    doc_ids = inverted_index.postings(term_ids[0])[0::2]
+    for term_id in term_ids[1:]:
+        if not doc_ids:
+            break
+        if inverted_index.doc_frequency(term_id) > SCAN_RATIO * len(doc_ids):
+            doc_ids = intersect(doc_ids, term_cursor(term_id, inverted_index, skip_lists))
+        else:
+            candidates = set(doc_ids)
+            doc_ids = [doc_id for doc_id in islice(inverted_index.postings(term_id), 0, None, 2) if doc_id in candidates]
+    return doc_ids
 
-def intersection_of_2(list1: list[int], list2: list[int]) -> list[int]:
-    i, j = 0, 0
+def intersect(doc_ids, cursor):
+    """
+    Returns the sorted doc_ids that the cursor's list also has.
+    """
     intersection = []
-    while i < len(list1) and j < len(list2):
-        docID1 = list1[i]
-        docID2 = list2[j]
-        if docID1 == docID2:
-            intersection.append(docID1)
-            i += 1
-            j += 2
-        elif docID1 < docID2:
-            i += 1
-        else:
-            j += 2
+    for doc_id in doc_ids:
+        found = cursor.next_geq(doc_id)
+        if found is None:
+            break
+        if found == doc_id:
+            intersection.append(doc_id)
     return intersection
 
 def write_to_txt(list_output, file_output):
@@ -90,7 +126,7 @@ def read_json(file_path):
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
-        description='Perform Boolean AND retrieval on an inverted index.'
+        description='Perform Boolean retrieval on an inverted index. Queries are words joined by AND, OR and NOT with parentheses, words next to each other are ANDed.'
     )
 
     parser.add_argument('directory_path', type=str,
@@ -99,6 +135,12 @@ if __name__ == "__main__":
                         help='Path to the queries JSON file.')
     parser.add_argument('file_output', type=str,
                         help='Path to the output file where results will be stored.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes the topics are evaluated in. The index is loaded once and shared with them.')
+    parser.add_argument('--postings_cache_mb', type=float, default=0,
+                        help='If set, decoded posting lists are kept in a cache of this many MB.')
+    parser.add_argument('--warm_up', type=str, default=None,
+                        help='Queries JSON file whose most frequent terms are loaded into the posting list cache before retrieval.')
 
     args = parser.parse_args()
 
@@ -111,4 +153,4 @@ if __name__ == "__main__":
             "python BooleanAND.py /home/smucker/latimes-index queries.txt hw2-results-WatIAMUserID.txt" 
         )
 
-    boolean_and(args.directory_path, args.queries_path, args.file_output)
\ No newline at end of file
+    boolean_and(args.directory_path, args.queries_path, args.file_output, args.workers, args.postings_cache_mb, args.warm_up)
\ No newline at end of file
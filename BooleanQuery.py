@@ -0,0 +1,255 @@
+import re
+import heapq
+from IndexEngine import TokenizeStrings
+from BinaryIndex import GallopingCursor
+
+QUERY_PATTERN = re.compile(r"\(|\)|[^\s()]+")
+OPERATORS = ("AND", "OR", "NOT")
+
+
+def parse_boolean_query(query_text, stemmer=None):
+    """
+    Parses a boolean query into a tree of ("and", [children]), ("or",
+    [children]), ("not", child) and ("term", token) nodes, or None when the
+    query has no terms. AND, OR and NOT are operators when upper case, NOT
+    binds tightest and OR loosest, parentheses group, and words next to
+    each other are ANDed, so a plain list of words means what it always
+    did. A word is tokenized like the documents; one that gives no token is
+    left out.
+    """
+    words = QUERY_PATTERN.findall(query_text)
+    if not words:
+        return None
+    node, position = parse_or(words, 0, stemmer)
+    if position < len(words):
+        raise ValueError(f"Unexpected '{words[position]}' in the query '{query_text}'")
+    return node
+
+
+def parse_or(words, position, stemmer):
+    node, position = parse_and(words, position, stemmer)
+    children = [node]
+    while position < len(words) and words[position] == "OR":
+        node, position = parse_and(words, position + 1, stemmer)
+        children.append(node)
+    return combine("or", children), position
+
+
+def parse_and(words, position, stemmer):
+    node, position = parse_not(words, position, stemmer)
+    children = [node]
+    while position < len(words) and words[position] not in ("OR", ")"):
+        if words[position] == "AND":
+            position += 1
+        node, position = parse_not(words, position, stemmer)
+        children.append(node)
+    return combine("and", children), position
+
+
+def parse_not(words, position, stemmer):
+    if position < len(words) and words[position] == "NOT":
+        node, position = parse_not(words, position + 1, stemmer)
+        if node is None:
+            return None, position
+        # NOT NOT x is x
+        return (node[1] if node[0] == "not" else ("not", node)), position
+    return parse_operand(words, position, stemmer)
+
+
+def parse_operand(words, position, stemmer):
+    if position >= len(words):
+        raise ValueError("The query ends where a term was expected")
+    word = words[position]
+    if word == "(":
+        node, position = parse_or(words, position + 1, stemmer)
+        if position >= len(words) or words[position] != ")":
+            raise ValueError("Missing closing parenthesis in the query")
+        return node, position + 1
+    if word in OPERATORS or word == ")":
+        raise ValueError(f"Expected a term but found '{word}' in the query")
+    tokens = []
+    TokenizeStrings([word], tokens, stemmer)
+    return combine("and", [("term", token) for token in tokens]), position + 1
+
+
+def combine(operator, children):
+    """
+    Joins the children with the operator, leaving out empty ones and merging
+    nested nodes of the same operator into one.
+    """
+    flattened = []
+    for child in children:
+        if child is None:
+            continue
+        if child[0] == operator:
+            flattened.extend(child[1])
+        else:
+            flattened.append(child)
+    if not flattened:
+        return None
+    if len(flattened) == 1:
+        return flattened[0]
+    return (operator, flattened)
+
+
+def conjunction_tokens(node):
+    """
+    Returns the tokens of a query that is a plain AND of terms, or None for
+    any other query.
+    """
+    if node is None:
+        return []
+    if node[0] == "term":
+        return [node[1]]
+    if node[0] == "and" and all(child[0] == "term" for child in node[1]):
+        return [child[1] for child in node[1]]
+    return None
+
+
+def term_cursor(term_id, inverted_index, skip_lists=None):
+    if skip_lists is not None:
+        return skip_lists.cursor(term_id)
+    return GallopingCursor(inverted_index.postings(term_id))
+
+
+class TermIterator:
+    def __init__(self, cursor, doc_frequency):
+        self.next_geq = cursor.next_geq
+        self.cost = doc_frequency
+
+
+class AndIterator:
+    """
+    Documents in all the included iterators and in none of the excluded ones.
+    The included iterators are ordered cheapest first, so the rarest one
+    proposes the candidates and the others only skip ahead to them.
+    """
+
+    def __init__(self, included, excluded):
+        self.included = sorted(included, key=lambda iterator: iterator.cost)
+        # the most common exclusions are the most likely to reject a candidate
+        self.excluded = sorted(excluded, key=lambda iterator: iterator.cost, reverse=True)
+        self.cost = self.included[0].cost
+
+    def next_geq(self, target):
+        candidate = target
+        while True:
+            for iterator in self.included:
+                doc_id = iterator.next_geq(candidate)
+                if doc_id is None:
+                    return None
+                if doc_id != candidate:
+                    candidate = doc_id
+                    break
+            else:
+                if not any(iterator.next_geq(candidate) == candidate for iterator in self.excluded):
+                    return candidate
+                candidate += 1
+
+
+class OrIterator:
+    """
+    Documents in any of the iterators, merged with a heap of their current
+    doc ids.
+    """
+
+    def __init__(self, iterators):
+        self.iterators = iterators
+        self.heap = None
+        self.cost = sum(iterator.cost for iterator in iterators)
+
+    def next_geq(self, target):
+        if self.heap is None:
+            self.heap = []
+            for i, iterator in enumerate(self.iterators):
+                doc_id = iterator.next_geq(target)
+                if doc_id is not None:
+                    self.heap.append((doc_id, i))
+            heapq.heapify(self.heap)
+        heap = self.heap
+        while heap and heap[0][0] < target:
+            doc_id = self.iterators[heap[0][1]].next_geq(target)
+            if doc_id is None:
+                heapq.heappop(heap)
+            else:
+                heapq.heapreplace(heap, (doc_id, heap[0][1]))
+        return heap[0][0] if heap else None
+
+
+class NotIterator:
+    """
+    Documents of the collection that are not in the iterator, or all of them
+    when the iterator is None.
+    """
+
+    def __init__(self, iterator, num_docs):
+        self.iterator = iterator
+        self.num_docs = num_docs
+        self.cost = num_docs - (iterator.cost if iterator is not None else 0)
+        self.doc_id = 0
+
+    def next_geq(self, target):
+        # the iterator has moved past the last doc id returned, which stays the answer below it
+        doc_id = max(target, self.doc_id)
+        while doc_id < self.num_docs:
+            if self.iterator is None or self.iterator.next_geq(doc_id) != doc_id:
+                self.doc_id = doc_id
+                return doc_id
+            doc_id += 1
+        self.doc_id = self.num_docs
+        return None
+
+
+def compile_query(node, lexicon, inverted_index, skip_lists=None, num_docs=0):
+    """
+    Turns a parsed query into a tree of lazy iterators over the posting
+    lists, or None when it matches no document. Terms missing from the
+    lexicon match nothing, NOT inside an AND excludes documents instead of
+    enumerating the rest of the collection, and NOTs alone fall back to
+    the complement, which needs num_docs.
+
+    Parameters:
+    - node: The query tree returned by parse_boolean_query.
+    - skip_lists: Optional. The skip lists of the index, so terms are read through skipping cursors.
+    - num_docs: The number of documents of the collection.
+    """
+    if node is None:
+        return None
+    if node[0] == "term":
+        if node[1] not in lexicon:
+            return None
+        term_id = lexicon[node[1]]
+        return TermIterator(term_cursor(term_id, inverted_index, skip_lists), inverted_index.doc_frequency(term_id))
+    if node[0] == "not":
+        return NotIterator(compile_query(node[1], lexicon, inverted_index, skip_lists, num_docs), num_docs)
+
+    children = [compile_query(child, lexicon, inverted_index, skip_lists, num_docs) for child in node[1]]
+    if node[0] == "or":
+        children = [child for child in children if child is not None]
+        if not children:
+            return None
+        return children[0] if len(children) == 1 else OrIterator(children)
+    if any(child is None for child in children):
+        return None
+    included = [child for child in children if not isinstance(child, NotIterator)]
+    excluded = [child.iterator for child in children if isinstance(child, NotIterator) and child.iterator is not None]
+    if not included:
+        # NOT a AND NOT b is NOT (a OR b)
+        if not excluded:
+            return NotIterator(None, num_docs)
+        return NotIterator(excluded[0] if len(excluded) == 1 else OrIterator(excluded), num_docs)
+    if len(included) == 1 and not excluded:
+        return included[0]
+    return AndIterator(included, excluded)
+
+
+def matching_doc_ids(iterator):
+    """
+    Yields the doc ids an iterator tree matches, in increasing order.
+    """
+    if iterator is None:
+        return
+    doc_id = iterator.next_geq(0)
+    while doc_id is not None:
+        yield doc_id
+        doc_id = iterator.next_geq(doc_id + 1)
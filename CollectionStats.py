@@ -0,0 +1,151 @@
+import os
+import struct
+from array import array
+from math import log
+from BinaryIndex import SegmentedPostingsReader, decode_postings_arrays
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+STATS_FILE = "bm25-stats.bin"
+MAGIC = b"BM25STA2"
+# magic, N, number of terms, k1, b, avdl
+HEADER = struct.Struct("<8sQQddd")
+# followed by the doc_lengths, length_norms, doc_frequencies, idf and max_scores columns
+# the max scores are computed with NumPy from about this many postings at a time
+MAX_SCORES_CHUNK = 1 << 20
+
+
+class CollectionStats:
+    """
+    Collection statistics for BM25 as flat arrays: the document lengths, the
+    length normalisation K = k1 * ((1 - b) + b * (dl / avdl)) of every
+    document and the df and idf of every term id, with
+    idf = log((N - ni + 0.5) / (ni + 0.5)).
+    max_scores holds the largest score a single posting of each term has; it
+    is only known for the k1 and b the statistics were written with.
+    """
+
+    def __init__(self, doc_lengths, doc_frequencies, k1=1.2, b=0.75, avdl=None, length_norms=None, idf=None, max_scores=None):
+        self.doc_lengths = doc_lengths
+        self.doc_frequencies = doc_frequencies
+        self.N = len(doc_lengths)
+        self.k1 = k1
+        self.b = b
+        self.avdl = avdl if avdl is not None else sum(doc_lengths) / self.N
+        self.length_norms = length_norms if length_norms is not None else compute_length_norms(doc_lengths, self.avdl, k1, b)
+        self.idf = idf if idf is not None else array("d", [log((self.N - ni + 0.5) / (ni + 0.5)) for ni in doc_frequencies])
+        self.max_scores = max_scores
+
+    @classmethod
+    def from_index(cls, doc_lengths, inverted_index, k1=1.2, b=0.75):
+        doc_frequencies = array("I", [inverted_index.doc_frequency(term_id) for term_id in range(len(inverted_index))])
+        return cls(array("I", doc_lengths), doc_frequencies, k1, b)
+
+    def max_score(self, term_id, postings):
+        """
+        Returns the largest score of a posting of the term, computed from its
+        posting list when it was not stored.
+        """
+        if self.max_scores is not None:
+            return self.max_scores[term_id]
+        idf = self.idf[term_id]
+        length_norms = self.length_norms
+        return max((idf * (postings[i + 1] / (postings[i + 1] + length_norms[postings[i]])) for i in range(0, len(postings), 2)), default=0)
+
+    def with_parameters(self, k1, b):
+        """
+        Returns the statistics for other k1 and b, recomputing only the length normalisation.
+        """
+        if k1 == self.k1 and b == self.b:
+            return self
+        return CollectionStats(self.doc_lengths, self.doc_frequencies, k1, b, self.avdl, idf=self.idf)
+
+    def write(self, path):
+        with open(path, "wb") as file:
+            file.write(HEADER.pack(MAGIC, self.N, len(self.doc_frequencies), self.k1, self.b, self.avdl))
+            self.doc_lengths.tofile(file)
+            self.length_norms.tofile(file)
+            self.doc_frequencies.tofile(file)
+            self.idf.tofile(file)
+            self.max_scores.tofile(file)
+
+
+def compute_length_norms(doc_lengths, avdl, k1, b):
+    return array("d", [k1 * ((1 - b) + b * (dl / avdl)) for dl in doc_lengths])
+
+
+def read_collection_stats(path):
+    with open(path, "rb") as file:
+        data = file.read()
+    magic, N, num_terms, k1, b, avdl = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a BM25 statistics file")
+    offset = HEADER.size
+    columns = []
+    for typecode, length in (("I", N), ("d", N), ("I", num_terms), ("d", num_terms), ("d", num_terms)):
+        column = array(typecode)
+        column.frombytes(data[offset:offset + length * column.itemsize])
+        offset += length * column.itemsize
+        columns.append(column)
+    doc_lengths, length_norms, doc_frequencies, idf, max_scores = columns
+    return CollectionStats(doc_lengths, doc_frequencies, k1, b, avdl, length_norms, idf, max_scores)
+
+
+def compute_max_scores(stats, inverted_index):
+    """
+    Returns the largest posting score of every term. With NumPy every segment
+    is decoded a run of whole lists at a time and each list's maximum is
+    taken with one reduceat, with the arithmetic of max_score; without it
+    every list is decoded in Python.
+    """
+    if np is None:
+        return array("d", [stats.max_score(term_id, inverted_index.postings(term_id)) for term_id in range(len(inverted_index))])
+    readers = inverted_index.readers if isinstance(inverted_index, SegmentedPostingsReader) else [inverted_index]
+    idf = np.frombuffer(stats.idf, dtype=np.float64)
+    length_norms = np.frombuffer(stats.length_norms, dtype=np.float64)
+    max_scores = np.full(len(inverted_index), -np.inf)
+    for reader in readers:
+        doc_frequencies = np.frombuffer(reader.doc_frequencies, dtype=np.uint32).astype(np.int64)
+        ends = np.cumsum(doc_frequencies)
+        first = 0
+        while first < len(reader):
+            last = max(first + 1, int(np.searchsorted(ends, ends[first] - doc_frequencies[first] + MAX_SCORES_CHUNK, side="right")))
+            term_ids = first + np.flatnonzero(doc_frequencies[first:last])
+            if len(term_ids):
+                counts = doc_frequencies[term_ids]
+                starts = np.cumsum(counts) - counts
+                doc_ids, frequencies = decode_postings_arrays(reader.encoded_range(first, last))
+                # every list is gap encoded from 0, so the doc ids of a list drop the sum of the lists before it
+                bases = np.zeros_like(starts)
+                bases[1:] = doc_ids[starts[1:] - 1]
+                doc_ids -= np.repeat(bases, counts)
+                scores = np.repeat(idf[term_ids], counts) * (frequencies / (frequencies + length_norms[doc_ids]))
+                max_scores[term_ids] = np.maximum(max_scores[term_ids], np.maximum.reduceat(scores, starts))
+            first = last
+    # terms without postings score 0, as in max_score
+    max_scores[max_scores == -np.inf] = 0
+    return array("d", max_scores.tobytes())
+
+
+def write_collection_stats(directory_path, doc_lengths, inverted_index, k1=1.2, b=0.75):
+    stats = CollectionStats.from_index(doc_lengths, inverted_index, k1, b)
+    stats.max_scores = compute_max_scores(stats, inverted_index)
+    stats.write(os.path.join(directory_path, STATS_FILE))
+    return stats
+
+
+def load_collection_stats(directory_path, inverted_index=None, k1=1.2, b=0.75):
+    """
+    Loads the statistics written at index time for the given k1 and b. Indexes
+    built before the statistics file existed fall back to computing them from
+    doc-lengths.txt and the posting list directory.
+    """
+    stats_path = os.path.join(directory_path, STATS_FILE)
+    if os.path.exists(stats_path):
+        return read_collection_stats(stats_path).with_parameters(k1, b)
+    with open(os.path.join(directory_path, "doc-lengths.txt"), "r") as file:
+        doc_lengths = [int(line.strip()) for line in file]
+    return CollectionStats.from_index(doc_lengths, inverted_index, k1, b)
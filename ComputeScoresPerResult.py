@@ -1,8 +1,21 @@
 import os
 import math
 from collections import defaultdict
+from multiprocessing import Pool
 import argparse
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# results of a topic that count towards the metrics
+DEPTH = 1000
+# the discount of every rank, computed like dcg_at_k so the vectorized DCGs are the same floats
+DISCOUNTS = [math.log2(i + 2) for i in range(DEPTH)]
+
+evaluation_table = None
+
 def read_qrels(file_path):
     qrels = defaultdict(lambda: defaultdict(int))
     total_relevant_docs = defaultdict(int)
@@ -64,14 +77,14 @@ def read_results(file_path):
                     print(f"Invalid rank in results file: {line.strip()}")
                     return "bad format"
                 try:
-                    float(score)
+                    score = float(score)
                 except ValueError:
                     print(f"Invalid score in results file: {line.strip()}")
                     return "bad format"
                 if not run_tag.isalnum() or len(run_tag) > 12:
                     print(f"Invalid runTag in results file: {line.strip()}")
                     return "bad format"
-                results[int(topic_id)].append((docno, float(score)))
+                results[int(topic_id)].append((docno, score))
     except Exception as e:
         print(f"Error reading results file: {e}")
         return "bad format"
@@ -120,50 +133,149 @@ def ndcg_at_k(qrels, results, topic_id, k, idcg):
 
     return dcg / idcg
 
-def main(qrels_folder, results_folder, output_folder):
+class QrelsTable:
+    """
+    The judgments of a qrels file, read once and shared by the evaluation of
+    every run. With NumPy the judged documents are kept as sorted (topic
+    row, docno id) keys with their grades, and the number of relevant
+    documents and the ideal DCGs as per topic arrays, so the metrics of all
+    topics of a run are computed together; without it every topic goes
+    through the functions above.
+    """
+
+    def __init__(self, qrels, total_relevant_docs, idcg_per_topic, topic_ids):
+        self.qrels = qrels
+        self.total_relevant_docs = total_relevant_docs
+        self.idcg_per_topic = idcg_per_topic
+        self.topic_ids = topic_ids
+        if np is None:
+            return
+        self.docno_ids = {}
+        keys = []
+        grades = []
+        for row, topic_id in enumerate(topic_ids):
+            for docno, judgment in qrels[topic_id].items():
+                keys.append((row << 32) | self.docno_ids.setdefault(docno, len(self.docno_ids)))
+                grades.append(judgment)
+        order = np.argsort(np.array(keys, dtype=np.int64))
+        self.keys = np.array(keys, dtype=np.int64)[order]
+        self.grades = np.array(grades, dtype=np.int64)[order]
+        self.total_relevant = np.array([total_relevant_docs.get(topic_id, 0) for topic_id in topic_ids], dtype=np.int64)
+        self.idcg_10 = np.array([idcg_per_topic[topic_id]['10'] for topic_id in topic_ids])
+        self.idcg_1000 = np.array([idcg_per_topic[topic_id]['1000'] for topic_id in topic_ids])
+        self.discounts = np.array(DISCOUNTS)
+
+    def grade_matrix(self, results):
+        """
+        Returns the (topic, rank) matrix of the grades of the top DEPTH results
+        of every topic, 0 for unjudged documents and past the end of a ranking.
+        """
+        grades = np.zeros((len(self.topic_ids), DEPTH), dtype=np.int64)
+        rows = []
+        ranks = []
+        docno_ids = []
+        for row, topic_id in enumerate(self.topic_ids):
+            for rank, (docno, _) in enumerate(results.get(topic_id, [])[:DEPTH]):
+                docno_id = self.docno_ids.get(docno)
+                if docno_id is not None:
+                    rows.append(row)
+                    ranks.append(rank)
+                    docno_ids.append(docno_id)
+        if not rows:
+            return grades
+        rows = np.array(rows, dtype=np.int64)
+        keys = (rows << 32) | np.array(docno_ids, dtype=np.int64)
+        positions = np.searchsorted(self.keys, keys).clip(max=len(self.keys) - 1)
+        judged = self.keys[positions] == keys
+        grades[rows[judged], np.array(ranks)[judged]] = self.grades[positions[judged]]
+        return grades
+
+    def scores(self, results):
+        """
+        Returns the (topic id, AP, P@10, NDCG@10, NDCG@1000) of every topic of
+        the qrels. The running sums add the same terms in the same order as
+        the per topic functions, so the scores are exactly the same.
+        """
+        if np is None:
+            return [(topic_id,
+                     average_precision(self.qrels, results, topic_id, self.total_relevant_docs.get(topic_id, 0)),
+                     precision_at_k(self.qrels, results, topic_id, 10),
+                     ndcg_at_k(self.qrels, results, topic_id, 10, self.idcg_per_topic[topic_id]['10']),
+                     ndcg_at_k(self.qrels, results, topic_id, 1000, self.idcg_per_topic[topic_id]['1000']))
+                    for topic_id in self.topic_ids]
+        grades = self.grade_matrix(results)
+        relevant = grades > 0
+        precisions = np.where(relevant, np.cumsum(relevant, axis=1) / np.arange(1, DEPTH + 1), 0.0)
+        sum_precision = np.cumsum(precisions, axis=1)[:, -1]
+        ap = np.divide(sum_precision, self.total_relevant, out=np.zeros(len(self.topic_ids)), where=self.total_relevant > 0)
+        p10 = relevant[:, :10].sum(axis=1) / 10
+        dcg = np.cumsum(grades / self.discounts, axis=1)
+        ndcg10 = np.divide(dcg[:, 9], self.idcg_10, out=np.zeros(len(self.topic_ids)), where=self.idcg_10 != 0)
+        ndcg1000 = np.divide(dcg[:, DEPTH - 1], self.idcg_1000, out=np.zeros(len(self.topic_ids)), where=self.idcg_1000 != 0)
+        return list(zip(self.topic_ids, ap.tolist(), p10.tolist(), ndcg10.tolist(), ndcg1000.tolist()))
+
+def init_evaluation_worker(table):
+    global evaluation_table
+    evaluation_table = table
+
+def evaluate_run(results_folder, results_file, output_folder):
+    """
+    Reads one results file and writes its per topic scores against the qrels
+    of evaluation_table to <results_file>_scores.txt.
+    """
+    results = read_results(os.path.join(results_folder, results_file))
+
+    output_lines = ["Topic,Average Precision,P@10,NDCG@10,NDCG@1000\n"]
+
+    if results == "bad format":
+        print(f"Results file {results_file} is improperly formatted.")
+        output_lines.append("bad format,bad format,bad format,bad format\n")
+    else:
+        for topic_id, ap, p10, ndcg10, ndcg1000 in evaluation_table.scores(results):
+            output_lines.append(f"{topic_id},{ap:.4f},{p10:.4f},{ndcg10:.4f},{ndcg1000:.4f}\n")
+
+    output_file_name = f"{results_file}_scores.txt"
+    output_file_path = os.path.join(output_folder, output_file_name)
+    with open(output_file_path, 'w') as out_file:
+        out_file.writelines(output_lines)
+
+def main(qrels_folder, results_folder, output_folder, workers=1):
+    """
+    Evaluates every results file in results_folder. Each qrels and results
+    file is read once, and with workers > 1 the results files are evaluated
+    in a pool of processes.
+    """
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
+    table = None
     for qrels_file in os.listdir(qrels_folder):
         qrels_path = os.path.join(qrels_folder, qrels_file)
         qrels, total_relevant_docs, idcg_per_topic, topic_ids = read_qrels(qrels_path)
         if qrels == "bad format":
             print(f"Qrels file {qrels_file} is improperly formatted.")
             continue
+        # the scores against every qrels file go to the same <results_file>_scores.txt, the last one is what it keeps
+        table = QrelsTable(qrels, total_relevant_docs, idcg_per_topic, topic_ids)
+    if table is None:
+        return
 
-        for results_file in os.listdir(results_folder):
-            results_path = os.path.join(results_folder, results_file)
-            results = read_results(results_path)
-
-            output_lines = ["Topic,Average Precision,P@10,NDCG@10,NDCG@1000\n"]
-
-            if results == "bad format":
-                print(f"Results file {results_file} is improperly formatted.")
-                output_lines.append("bad format,bad format,bad format,bad format\n")
-            else:
-                for topic_id in topic_ids:
-                    total_relevant = total_relevant_docs.get(topic_id, 0)
-                    idcg_10 = idcg_per_topic[topic_id]['10']
-                    idcg_1000 = idcg_per_topic[topic_id]['1000']
-
-                    ap = average_precision(qrels, results, topic_id, total_relevant)
-                    p10 = precision_at_k(qrels, results, topic_id, 10)
-                    ndcg10 = ndcg_at_k(qrels, results, topic_id, 10, idcg_10)
-                    ndcg1000 = ndcg_at_k(qrels, results, topic_id, 1000, idcg_1000)
-
-                    output_lines.append(f"{topic_id},{ap:.4f},{p10:.4f},{ndcg10:.4f},{ndcg1000:.4f}\n")
-
-            output_file_name = f"{results_file}_scores.txt"
-            output_file_path = os.path.join(output_folder, output_file_name)
-            with open(output_file_path, 'w') as out_file:
-                out_file.writelines(output_lines)
+    tasks = [(results_folder, results_file, output_folder) for results_file in os.listdir(results_folder)]
+    if workers > 1:
+        with Pool(workers, initializer=init_evaluation_worker, initargs=(table,)) as pool:
+            pool.starmap(evaluate_run, tasks)
+    else:
+        init_evaluation_worker(table)
+        for task in tasks:
+            evaluate_run(*task)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process Qrels and Results files to calculate evaluation metrics.")
     parser.add_argument("qrels_folder", type=str, help="Path to the folder containing qrels files")
     parser.add_argument("results_folder", type=str, help="Path to the folder containing results files")
     parser.add_argument("output_folder", type=str, help="Path to the folder to store output files")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes the results files are evaluated in")
 
     args = parser.parse_args()
 
-    main(args.qrels_folder, args.results_folder, args.output_folder)
+    main(args.qrels_folder, args.results_folder, args.output_folder, args.workers)
@@ -0,0 +1,105 @@
+import os
+import mmap
+import zlib
+import struct
+from functools import lru_cache
+
+DOCUMENTS_FILE = "documents.bin"
+OFFSETS_FILE = "documents-offsets.bin"
+BLOCK_SIZE = 64 * 1024
+# block offset, compressed block length, document offset in block, document length
+ENTRY = struct.Struct("<QIII")
+
+
+class DocStoreWriter:
+    """
+    Packs raw documents into zlib compressed blocks of about BLOCK_SIZE bytes.
+    Documents are stored in internal id order, each with a fixed size entry
+    in the offset table. Both files are append only, so new batches of
+    documents can be added to an existing store.
+    """
+
+    def __init__(self, directory_path, append=False):
+        mode = "ab" if append else "wb"
+        self.documents_file = open(os.path.join(directory_path, DOCUMENTS_FILE), mode)
+        self.offsets_file = open(os.path.join(directory_path, OFFSETS_FILE), mode)
+        self.position = self.documents_file.tell()
+        self.block = bytearray()
+        self.block_entries = []
+
+    def add(self, content):
+        data = content.encode("utf-8")
+        self.block_entries.append((len(self.block), len(data)))
+        self.block.extend(data)
+        if len(self.block) >= BLOCK_SIZE:
+            self.flush_block()
+
+    def flush_block(self):
+        if not self.block_entries:
+            return
+        compressed = zlib.compress(bytes(self.block))
+        self.documents_file.write(compressed)
+        for doc_offset, doc_length in self.block_entries:
+            self.offsets_file.write(ENTRY.pack(self.position, len(compressed), doc_offset, doc_length))
+        self.position += len(compressed)
+        self.block = bytearray()
+        self.block_entries = []
+
+    def close(self):
+        self.flush_block()
+        self.documents_file.close()
+        self.offsets_file.close()
+
+
+class DocStore:
+    """
+    Random access to the packed documents by internal id.
+    """
+
+    def __init__(self, directory_path):
+        documents_path = os.path.join(directory_path, DOCUMENTS_FILE)
+        if not os.path.exists(documents_path):
+            raise ValueError(f"No document store found in {directory_path}")
+        self.documents_file = open(documents_path, "rb")
+        self.documents = mmap.mmap(self.documents_file.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(os.path.join(directory_path, OFFSETS_FILE), "rb") as file:
+            self.offsets = file.read()
+        self.num_docs = len(self.offsets) // ENTRY.size
+
+    def __len__(self):
+        return self.num_docs
+
+    def entry(self, doc_id):
+        if not 0 <= doc_id < self.num_docs:
+            raise ValueError(f"The internal id {doc_id} does not exist in the document store")
+        return ENTRY.unpack_from(self.offsets, doc_id * ENTRY.size)
+
+    def read_block(self, block_offset, block_length):
+        return zlib.decompress(self.documents[block_offset:block_offset + block_length])
+
+    def get(self, doc_id):
+        block_offset, block_length, doc_offset, doc_length = self.entry(doc_id)
+        block = self.read_block(block_offset, block_length)
+        return block[doc_offset:doc_offset + doc_length].decode("utf-8")
+
+    def get_many(self, doc_ids):
+        """
+        Fetches several documents, decompressing every block they live in only once.
+        The documents are returned in the order of doc_ids.
+        """
+        entries = [self.entry(doc_id) for doc_id in doc_ids]
+        blocks = {}
+        for block_offset, block_length, _, _ in sorted(entries):
+            if block_offset not in blocks:
+                blocks[block_offset] = self.read_block(block_offset, block_length)
+        return [blocks[block_offset][doc_offset:doc_offset + doc_length].decode("utf-8")
+                for block_offset, _, doc_offset, doc_length in entries]
+
+    def close(self):
+        self.documents.close()
+        self.documents_file.close()
+
+
+@lru_cache(maxsize=None)
+def open_doc_store(directory_path):
+    return DocStore(directory_path)
@@ -0,0 +1,152 @@
+import heapq
+from bisect import bisect_left
+
+# documents are gathered from the essential posting lists one doc id window at a time
+WINDOW_SIZE = 4096
+# slack on the pruning tests, so bounds summed in a different order than the
+# final score can never prune a document that belongs in the top k
+EPSILON = 1e-9
+
+
+def maxscore_top_k(term_ids, inverted_index, stats, k, allowed=None, skip_lists=None):
+    """
+    Document-at-a-time MaxScore. Returns the same [(doc_id, score), ...] as
+    sorting the exhaustive scores and keeping the first k: scores are summed
+    in query order and ties keep the order of the exhaustive ranking.
+
+    Every term has an upper bound, its largest posting score times the number
+    of times it occurs in the query. Sorted by bound, the terms whose bounds
+    add up to less than the current k-th score are non-essential: a document
+    containing only those terms cannot enter the top k, so only the postings
+    of the essential terms generate candidates and the non-essential lists
+    are only probed for the candidates that can still make it. The documents
+    of the highest bound terms (usually the rarest ones) are scored first, so
+    the k-th score is high from the start.
+
+    With skip lists and stored upper bounds, only the lists that generate
+    candidates are decoded; the others are probed through skipping cursors,
+    which decode only the blocks holding the probed documents.
+
+    Parameters:
+    - term_ids: The term ids of the query tokens found in the lexicon, in query order.
+    - allowed: Optional. When given, only these doc ids are ranked.
+    - skip_lists: Optional. The skip lists of the index (see BinaryIndex.open_skip_lists).
+    """
+    if k <= 0:
+        return []
+    weights = {}
+    for term_id in term_ids:
+        weights[term_id] = weights.get(term_id, 0) + 1
+
+    length_norms = stats.length_norms
+    idf = stats.idf
+    # the decoded lists, the others are only read through skip cursors
+    doc_ids = {}
+    frequencies = {}
+
+    def decode(term_id):
+        postings = inverted_index.postings(term_id)
+        doc_ids[term_id] = postings[0::2]
+        frequencies[term_id] = postings[1::2]
+        return postings
+
+    bounds = {}
+    for term_id in weights:
+        if not inverted_index.doc_frequency(term_id):
+            continue
+        # the bound is computed from the list when it was not stored
+        postings = decode(term_id) if skip_lists is None or stats.max_scores is None else None
+        bounds[term_id] = max(0, weights[term_id] * stats.max_score(term_id, postings))
+    if not bounds:
+        return []
+
+    def new_cursors():
+        return {term_id: 0 if term_id in doc_ids else skip_lists.cursor(term_id) for term_id in bounds}
+
+    # the exhaustive ranking breaks ties by the first query term of a document, then by doc id
+    term_ranks = {term_id: rank for rank, term_id in enumerate(bounds)}
+    ordered_terms = sorted(bounds, key=bounds.get)
+    cumulative_bounds = []
+    total = 0
+    for term_id in ordered_terms:
+        total += bounds[term_id]
+        cumulative_bounds.append(total)
+
+    top = []
+    threshold = float("-inf")
+    num_non_essential = 0
+
+    def evaluate(doc_id, cursors):
+        nonlocal threshold, num_non_essential
+        contributions = {}
+        score_bound = 0
+        for position in range(len(ordered_terms) - 1, -1, -1):
+            if score_bound + cumulative_bounds[position] < threshold - EPSILON:
+                return
+            term_id = ordered_terms[position]
+            cursor = cursors[term_id]
+            fi = None
+            if term_id in doc_ids:
+                term_doc_ids = doc_ids[term_id]
+                index = bisect_left(term_doc_ids, doc_id, cursor)
+                cursors[term_id] = index
+                if index < len(term_doc_ids) and term_doc_ids[index] == doc_id:
+                    fi = frequencies[term_id][index]
+            elif cursor.next_geq(doc_id) == doc_id:
+                fi = cursor.frequency()
+            if fi is not None:
+                contributions[term_id] = idf[term_id] * (fi / (fi + length_norms[doc_id]))
+                score_bound += contributions[term_id] * weights[term_id]
+        if score_bound < threshold - EPSILON:
+            return
+
+        score = 0
+        for term_id in term_ids:
+            if term_id in contributions:
+                score += contributions[term_id]
+        entry = (score, -min(term_ranks[term_id] for term_id in contributions), -doc_id)
+        if len(top) < k:
+            heapq.heappush(top, entry)
+        elif entry > top[0]:
+            heapq.heapreplace(top, entry)
+        else:
+            return
+        if len(top) == k:
+            threshold = top[0][0]
+            while num_non_essential < len(ordered_terms) and cumulative_bounds[num_non_essential] < threshold - EPSILON:
+                num_non_essential += 1
+
+    seeds = set()
+    for term_id in reversed(ordered_terms):
+        if len(seeds) >= k:
+            break
+        if term_id not in doc_ids:
+            decode(term_id)
+        seeds.update(doc_ids[term_id])
+    seed_cursors = new_cursors()
+    for doc_id in sorted(seeds):
+        if allowed is None or doc_id in allowed:
+            evaluate(doc_id, seed_cursors)
+
+    # terms that are non-essential by now never generate candidates, so their lists are never decoded
+    essential_terms = ordered_terms[num_non_essential:]
+    for term_id in essential_terms:
+        if term_id not in doc_ids:
+            decode(term_id)
+    cursors = new_cursors()
+    last_doc_id = max((doc_ids[term_id][-1] for term_id in essential_terms), default=-1)
+    for window_start in range(0, last_doc_id + 1, WINDOW_SIZE):
+        window_end = window_start + WINDOW_SIZE
+        candidates = set()
+        for term_id in ordered_terms[num_non_essential:]:
+            term_doc_ids = doc_ids[term_id]
+            start = bisect_left(term_doc_ids, window_start, cursors[term_id])
+            end = bisect_left(term_doc_ids, window_end, start)
+            candidates.update(term_doc_ids[start:end])
+        candidates -= seeds
+
+        for doc_id in sorted(candidates):
+            if allowed is None or doc_id in allowed:
+                evaluate(doc_id, cursors)
+
+    return [(-negative_doc_id, score) for score, _, negative_doc_id in sorted(top, reverse=True)]
@@ -1,9 +1,17 @@
 import os
-import json
 import argparse
 import re
+from DocStore import open_doc_store
+from MetaDataStore import open_metadata_store
 
 def get_doc(folder_path, input_type, key):
+    doc_no, id, meta_data = find_document(folder_path, input_type, key)
+    output_data(doc_no, id, meta_data, folder_path)
+
+def find_document(folder_path, input_type, key):
+    """
+    Validates the key and returns the (doc no, internal id, metadata) of the document.
+    """
     if input_type == "docno" and len(key) != 13:
         raise ValueError("Please provide a valid doc no, the length of a valid doc no is 13")
     
@@ -22,45 +30,26 @@ def get_doc(folder_path, input_type, key):
     if not os.path.exists(folder_path):
         raise ValueError("please provide a valid path to the contents being retrieved")
 
+    metadata_store = open_metadata_store(folder_path)
+
     if input_type == "docno": 
 
-        path_to_metadata = os.path.join(folder_path, f"MetaData/{key}.json")
+        id = metadata_store.doc_id(key)
 
-        if not os.path.exists(path_to_metadata):
+        if id is None:
             raise ValueError("the doc no given does not exist, input a valid doc no")
-        
-        with open(path_to_metadata, 'r') as file:
-            metadata = json.load(file)
 
-        id = metadata["internal_id"]
-        output_data(key, id, metadata, folder_path)
+        return key, id, metadata_store.get(id)
 
     else:
-        with open('mapping.json', 'r') as file:
-            data = json.load(file)
-
-        # dict_id_mapping = {}
-
-        # for i, doc_no in enumerate(doc_no_list):
-        #     dict_id_mapping[doc_no] = i
-    
-        doc_no_list = data["doc_nos"]
-        if len(doc_no_list) - 1 < int(key):
+        if len(metadata_store) - 1 < int(key):
             raise ValueError("Please provide a valid internal id, the current one provided is not found")
         
-        doc_no = doc_no_list[int(key)]
-        with open(folder_path + f"/MetaData/{doc_no}.json", 'r') as file:
-            metadata = json.load(file)
-        output_data(doc_no, key, metadata, folder_path)
+        doc_no = metadata_store.docno(int(key))
+        return doc_no, int(key), metadata_store.get(int(key))
 
 def output_data(doc_no, id, meta_data, folder_path):
-    date_list = list(doc_no.replace("LA", ""))
-    year = date_list[4] + date_list[5]
-    month = date_list[0]+date_list[1]
-    day = date_list[2]+date_list[3]
-    raw_text_path = os.path.join(folder_path, year, month, day, doc_no + ".txt")
-    with open(raw_text_path, 'r') as file:
-        raw_text = file.read()
+    raw_text = open_doc_store(folder_path).get(int(id))
     
     print("Docno: ",doc_no)
     print("Internal id: ",id)
@@ -69,26 +58,19 @@ def output_data(doc_no, id, meta_data, folder_path):
     print("raw document: ")
     print(raw_text)
 
-def return_data(doc_no, folder_path):
-    date_list = list(doc_no.replace("LA", ""))
-    year = date_list[4] + date_list[5]
-    month = date_list[0]+date_list[1]
-    day = date_list[2]+date_list[3]
-    raw_text_path = os.path.join(folder_path, year, month, day, doc_no + ".txt")
-    with open(raw_text_path, 'r') as file:
-        raw_text = file.read()
+def find_doc_id(doc_no, folder_path):
+    doc_id = open_metadata_store(folder_path).doc_id(doc_no)
+    if doc_id is None:
+        raise ValueError(f"the doc no {doc_no} does not exist, input a valid doc no")
+    return doc_id
 
-    
-    return remove_tags(raw_text).strip()
+def return_data_batch(doc_nos, folder_path):
+    raw_texts = open_doc_store(folder_path).get_many([find_doc_id(doc_no, folder_path) for doc_no in doc_nos])
+
+    return [remove_tags(raw_text).strip() for raw_text in raw_texts]
 
 def retrieve_data(doc_no, folder_path):
-    date_list = list(doc_no.replace("LA", ""))
-    year = date_list[4] + date_list[5]
-    month = date_list[0]+date_list[1]
-    day = date_list[2]+date_list[3]
-    raw_text_path = os.path.join(folder_path, year, month, day, doc_no + ".txt")
-    with open(raw_text_path, 'r') as file:
-        raw_text = file.read()
+    raw_text = open_doc_store(folder_path).get(find_doc_id(doc_no, folder_path))
     
     print(raw_text)
 
@@ -0,0 +1,48 @@
+import zlib
+from array import array
+
+EMPTY_SLOT = -1
+
+
+def key_hash(key, table_size):
+    return zlib.crc32(key) & (table_size - 1)
+
+
+def build_hash_table(keys):
+    """
+    Returns the open addressing hash table of byte string keys, where the id
+    of a key is its position in keys: a power of two number of slots, at
+    least twice the number of keys, holding the ids at the crc32 of their
+    key with linear probing and EMPTY_SLOT elsewhere. It is written to the
+    stores as is and memory-mapped back with map_hash_table.
+    """
+    table_size = 1
+    while table_size < 2 * len(keys):
+        table_size *= 2
+    table = array("i", [EMPTY_SLOT]) * table_size
+    for key_id, key in enumerate(keys):
+        slot = key_hash(key, table_size)
+        while table[slot] != EMPTY_SLOT:
+            slot = (slot + 1) & (table_size - 1)
+        table[slot] = key_id
+    return table
+
+
+def map_hash_table(view, offset, table_size):
+    return view[offset:offset + table_size * 4].cast("i")
+
+
+def lookup(table, key, key_at):
+    """
+    Returns the id of key in the table, or None. key_at returns the key of an
+    id and is only called for the ids on the probe sequence of key.
+    """
+    table_size = len(table)
+    slot = key_hash(key, table_size)
+    while True:
+        key_id = table[slot]
+        if key_id == EMPTY_SLOT:
+            return None
+        if key_at(key_id) == key:
+            return key_id
+        slot = (slot + 1) & (table_size - 1)
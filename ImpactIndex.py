@@ -0,0 +1,212 @@
+import os
+import json
+import time
+import argparse
+from BinaryIndex import PostingsWriter, PostingsReader, encode_vbyte, read_vbyte, open_inverted_index, read_manifest, write_manifest
+from CollectionStats import load_collection_stats
+
+IMPACTS_FILE = "impacts.bin"
+IMPACTS_INFO_FILE = "impacts.json"
+IMPACTS_MAGIC = b"IMPACTS1"
+IMPACT_BITS = 8
+# segments are decoded and scored this many postings at a time, a time budget is checked before each chunk
+CHUNK_SIZE = 4096
+
+
+def compute_impacts(postings, idf, length_norms):
+    return [idf * (postings[i + 1] / (postings[i + 1] + length_norms[postings[i]])) for i in range(0, len(postings), 2)]
+
+
+def encode_impact_segments(doc_ids, quantized):
+    """
+    Groups the postings of a term by quantized impact, highest impact first.
+    Each segment is an (impact, number of documents, byte length) header
+    followed by the gap encoded doc ids of the segment in increasing order.
+    """
+    by_impact = {}
+    for doc_id, impact in zip(doc_ids, quantized):
+        by_impact.setdefault(impact, []).append(doc_id)
+    out = bytearray()
+    for impact in sorted(by_impact, reverse=True):
+        gaps = bytearray()
+        previous = 0
+        for doc_id in by_impact[impact]:
+            encode_vbyte(doc_id - previous, gaps)
+            previous = doc_id
+        encode_vbyte(impact, out)
+        encode_vbyte(len(by_impact[impact]), out)
+        encode_vbyte(len(gaps), out)
+        out.extend(gaps)
+    return out
+
+
+def write_impact_index(directory_path, inverted_index, stats, bits=IMPACT_BITS):
+    """
+    Writes impacts.bin: for every term its postings with a precomputed BM25
+    impact, linearly quantized to 1..2^bits - 1 over the largest impact in the
+    collection and sorted by impact. Postings with a non-positive impact (terms
+    in more than half of the documents) can only lower a score and are left out.
+    The new file only replaces the old one once it is complete.
+    """
+    length_norms = stats.length_norms
+    max_impact = 0
+    for term_id in range(len(inverted_index)):
+        idf = stats.idf[term_id]
+        if idf > 0:
+            max_impact = max(max_impact, max(compute_impacts(inverted_index.postings(term_id), idf, length_norms), default=0))
+    levels = (1 << bits) - 1
+    scale = levels / max_impact if max_impact else 1.0
+
+    impacts_path = os.path.join(directory_path, IMPACTS_FILE)
+    with PostingsWriter(impacts_path + ".tmp", magic=IMPACTS_MAGIC) as writer:
+        for term_id in range(len(inverted_index)):
+            idf = stats.idf[term_id]
+            if idf <= 0:
+                writer.add_encoded(b"", 0)
+                continue
+            postings = inverted_index.postings(term_id)
+            quantized = [max(1, min(levels, round(impact * scale))) for impact in compute_impacts(postings, idf, length_norms)]
+            writer.add_encoded(encode_impact_segments(postings[::2], quantized), len(quantized))
+    os.replace(impacts_path + ".tmp", impacts_path)
+
+    with open(os.path.join(directory_path, IMPACTS_INFO_FILE), "w") as file:
+        json.dump({"bits": bits, "scale": scale, "k1": stats.k1, "b": stats.b}, file, indent=4)
+
+
+def read_impact_info(directory_path):
+    """
+    Returns the {"bits", "scale", "k1", "b"} the impact index was written with.
+    """
+    with open(os.path.join(directory_path, IMPACTS_INFO_FILE), "r") as file:
+        return json.load(file)
+
+
+def decode_doc_ids(data, start, end, doc_id=0, limit=None):
+    """
+    Decodes the gap encoded doc ids of data[start:end] following doc_id, at
+    most limit of them. Returns the doc ids and the offset and last doc id to
+    continue decoding from.
+    """
+    doc_ids = []
+    offset = start
+    while offset < end and (limit is None or len(doc_ids) < limit):
+        gap, offset = read_vbyte(data, offset)
+        doc_id += gap
+        doc_ids.append(doc_id)
+    return doc_ids, offset, doc_id
+
+
+class ImpactIndex:
+    """
+    Score-at-a-time evaluation over impacts.bin. The segments of all query
+    terms are processed from the highest to the lowest impact, so stopping
+    early (after a number of postings or a time budget) keeps the postings
+    that contribute the most to the final scores.
+    """
+
+    def __init__(self, directory_path):
+        self.reader = PostingsReader(os.path.join(directory_path, IMPACTS_FILE), magic=IMPACTS_MAGIC)
+        info = read_impact_info(directory_path)
+        self.bits = info["bits"]
+        self.scale = info["scale"]
+        self.k1 = info["k1"]
+        self.b = info["b"]
+
+    def segments(self, term_id):
+        """
+        Returns the (impact, number of documents, start, end) of every segment
+        of the term, highest impact first.
+        """
+        data = self.reader.encoded(term_id)
+        segments = []
+        offset = 0
+        while offset < len(data):
+            impact, offset = read_vbyte(data, offset)
+            count, offset = read_vbyte(data, offset)
+            length, offset = read_vbyte(data, offset)
+            segments.append((impact, count, offset, offset + length))
+            offset += length
+        return segments
+
+    def score(self, term_ids, max_postings=None, time_budget_ms=None):
+        """
+        Returns ({doc_id: score}, complete) for the query term ids. Repeated
+        terms count once per occurrence, as in the exhaustive scorer. When a
+        budget stops the evaluation, complete is False and the scores hold the
+        best approximation found so far.
+
+        Parameters:
+        - max_postings: Optional. Maximum number of postings to process.
+        - time_budget_ms: Optional. Time after which no more postings are processed.
+        """
+        deadline = time.perf_counter() + time_budget_ms / 1000 if time_budget_ms is not None else None
+        weights = {}
+        for term_id in term_ids:
+            weights[term_id] = weights.get(term_id, 0) + 1
+
+        queue = []
+        for term_id, weight in weights.items():
+            data = self.reader.encoded(term_id)
+            for impact, _, start, end in self.segments(term_id):
+                queue.append((impact * weight, data, start, end))
+        queue.sort(key=lambda segment: segment[0], reverse=True)
+
+        accumulators = {}
+        processed = 0
+        complete = True
+        for contribution, data, start, end in queue:
+            offset, last_doc_id = start, 0
+            while offset < end:
+                if (deadline is not None and time.perf_counter() >= deadline) or (max_postings is not None and processed >= max_postings):
+                    complete = False
+                    break
+                limit = CHUNK_SIZE if max_postings is None else min(CHUNK_SIZE, max_postings - processed)
+                doc_ids, offset, last_doc_id = decode_doc_ids(data, offset, end, last_doc_id, limit)
+                for doc_id in doc_ids:
+                    accumulators[doc_id] = accumulators.get(doc_id, 0) + contribution
+                processed += len(doc_ids)
+            if not complete:
+                break
+
+        return {doc_id: score / self.scale for doc_id, score in accumulators.items()}, complete
+
+    def close(self):
+        self.reader.close()
+
+
+def open_impact_index(directory_path):
+    """
+    Returns the ImpactIndex of the index, or None if it was built without one.
+    """
+    if not os.path.exists(os.path.join(directory_path, IMPACTS_FILE)):
+        return None
+    return ImpactIndex(directory_path)
+
+
+def build_impact_index(directory_path, bits=IMPACT_BITS, k1=1.2, b=0.75):
+    """
+    Adds an impact index to an existing index. It is marked in the segment
+    manifest, so appending documents keeps it up to date, and the version is
+    bumped so running engines reopen the index.
+    """
+    inverted_index = open_inverted_index(directory_path)
+    stats = load_collection_stats(directory_path, inverted_index, k1, b)
+    write_impact_index(directory_path, inverted_index, stats, bits)
+    inverted_index.close()
+    manifest = read_manifest(directory_path)
+    manifest["impacts"] = True
+    manifest["version"] += 1
+    write_manifest(directory_path, manifest)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build the impact ordered index used by the anytime BM25 mode.')
+
+    parser.add_argument('directory_path', type=str, help="Path to the directory containing the index files.")
+    parser.add_argument('--bits', type=int, default=IMPACT_BITS, help="Number of bits of the quantized impacts.")
+    parser.add_argument('--k1', type=float, default=1.2, help="BM25 k1 of the impacts.")
+    parser.add_argument('--b', type=float, default=0.75, help="BM25 b of the impacts.")
+
+    args = parser.parse_args()
+
+    build_impact_index(args.directory_path, args.bits, args.k1, args.b)
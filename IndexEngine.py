@@ -4,17 +4,45 @@ import json
 from datetime import datetime
 import argparse
 import re
+import shutil
+from collections import deque, OrderedDict
+from functools import partial
+from multiprocessing import Pool
 from PorterStemmer import PorterStemmer
-
-def unzip_file_and_read(file_path, output_dir, use_stemming=False):
-    if os.path.exists(output_dir) and os.path.isdir(output_dir):
+from DocStore import DocStoreWriter
+from MetaDataStore import MetaDataWriter
+from BinaryIndex import write_inverted_index, write_run, write_encoded_run, merge_runs, read_manifest, write_manifest, merge_segments, split_segments, open_inverted_index, positions_file_for, write_skips, POSTINGS_FILE
+from CollectionStats import write_collection_stats
+from ImpactIndex import write_impact_index, read_impact_info, IMPACTS_INFO_FILE, IMPACT_BITS
+from Positions import encode_positions, write_positional_index, merge_position_runs
+from LexiconStore import write_lexicon_store, LEXICON_FILE
+from SentenceTable import write_sentence_table
+
+POSTING_BYTES = 48
+TERM_BYTES = 120
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+UNICODE_TOKEN_PATTERN = re.compile(r"[^\W_]+")
+STEM_CACHE_SIZE = 100000
+STEM_MAP_FILE = "stem-map.json"
+
+def unzip_file_and_read(file_path, output_dir, use_stemming=False, workers=1, batch_size=1000, memory_budget=None, append=False, max_segments=None, positions=False, k1=1.2, b=0.75, impacts=False, shards=None, sentences=False):
+    if append:
+        if not os.path.isdir(output_dir):
+            raise ValueError(f"The folder '{output_dir}' does not exist, there is no index to append to.")
+        manifest = read_manifest(output_dir)
+        if manifest["use_stemming"] != use_stemming:
+            raise ValueError(f"The index in '{output_dir}' was built with use_stemming={manifest['use_stemming']}, the appended documents must use the same setting.")
+        positions = manifest.get("positions", False)
+        impacts = manifest.get("impacts", False)
+        # a table can be added to an index built without one, it then covers every document
+        sentences = sentences or manifest.get("sentences", False)
+        manifest["sentences"] = sentences
+    elif os.path.exists(output_dir) and os.path.isdir(output_dir):
         raise ValueError(f"The folder '{output_dir}' already exists.")
+    else:
+        manifest = {"segments": [], "use_stemming": use_stemming, "positions": positions, "impacts": impacts, "sentences": sentences, "version": 0}
 
     os.makedirs(output_dir, exist_ok=True)
-    current_directory = output_dir
-
-    metadata_dir = output_dir + "/MetaData"
-    os.makedirs(metadata_dir, exist_ok=True)
 
     list_doc_no = []
 
@@ -22,10 +50,140 @@ def unzip_file_and_read(file_path, output_dir, use_stemming=False):
 
     inverted_index = {}
 
+    positional_index = {} if positions else None
+
     list_doc_lengths = []
+
+    stem_map = {}
+
+    if append:
+        LoadIndexForAppend(output_dir, list_doc_no, lexicon, list_doc_lengths)
+        if use_stemming:
+            stem_map = LoadStemMap(output_dir)
+
+    first_doc_id = len(list_doc_lengths)
+
+    runs = IndexRuns(output_dir, memory_budget, positional_index)
+
+    doc_store = DocStoreWriter(output_dir, append=append)
+
+    metadata = MetaDataWriter(output_dir, append=append)
+
+    documents = ReadDocuments(file_path, doc_store, metadata, list_doc_no)
+
+    if workers > 1:
+        IndexDocumentsInParallel(documents, lexicon, inverted_index, positional_index, list_doc_lengths, runs, stem_map, use_stemming, workers, batch_size)
+    else:
+        stemmer = CachedStemmer(max_size=None, stem_map=stem_map) if use_stemming else None
+        for internal_id, filtered_content in enumerate(documents, start=first_doc_id):
+            tokens = []
+
+            TokenizeText(filtered_content, tokens, stemmer)
+
+            list_doc_lengths.append(len(tokens))
+
+            token_ids = ConvertTokensToIds(tokens, lexicon)
+
+            word_counts = CountWords(token_ids)
+
+            AddToPostings(word_counts, internal_id, inverted_index)
+
+            num_position_bytes = 0
+            if positional_index is not None:
+                num_position_bytes = AddToPositionalIndex(CollectPositions(token_ids), positional_index)
+
+            runs.add(len(word_counts), inverted_index, num_position_bytes)
+
+        if stemmer:
+            stem_map.update(stemmer.cache)
+
+    doc_store.close()
+
+    metadata.close()
+    
+    data = {'doc_nos': list_doc_no}
+    
+    with open('mapping.json', 'w') as json_file:
+        json.dump(data, json_file, indent=4)
+    
     
-    stemmer = PorterStemmer() if use_stemming else None
+    with open(os.path.join(output_dir,'doc-lengths.txt'), 'w') as file:
+        for length in list_doc_lengths:
+            file.write(f"{length}\n")
+    
+    with open(os.path.join(output_dir,'lexicon.json'), 'w') as file:
+        json.dump(lexicon, file, indent=4)
+    write_lexicon_store(os.path.join(output_dir, LEXICON_FILE), lexicon)
 
+    if use_stemming:
+        with open(os.path.join(output_dir, STEM_MAP_FILE), 'w') as file:
+            json.dump(stem_map, file)
+
+    if sentences:
+        sentence_stemmer = CachedStemmer(max_size=None, stem_map=stem_map) if use_stemming else None
+        write_sentence_table(output_dir, lexicon, partial(TokenizeSentence, stemmer=sentence_stemmer))
+    
+    segments = manifest["segments"]
+    segment_file = f"postings-{len(segments):04d}.bin" if segments else POSTINGS_FILE
+
+    runs.write_index(inverted_index, len(lexicon), os.path.join(output_dir, segment_file))
+    write_skips(output_dir, segment_file)
+
+    segments.append(segment_file)
+    write_manifest(output_dir, manifest)
+
+    index_reader = open_inverted_index(output_dir)
+    stats = write_collection_stats(output_dir, list_doc_lengths, index_reader, k1, b)
+    if impacts:
+        impact_stats, impact_bits = stats, IMPACT_BITS
+        if append and os.path.exists(os.path.join(output_dir, IMPACTS_INFO_FILE)):
+            # the impacts keep the k1, b and bits they were built with, not the defaults of this run
+            impact_info = read_impact_info(output_dir)
+            impact_stats, impact_bits = stats.with_parameters(impact_info["k1"], impact_info["b"]), impact_info["bits"]
+        write_impact_index(output_dir, index_reader, impact_stats, impact_bits)
+    index_reader.close()
+
+    # the files a running engine has open (lexicon, skips, impacts, manifest) are
+    # replaced, not rewritten, so it keeps reading the old index until the version
+    # changes here, once everything about the new documents is written
+    manifest["version"] += 1
+    write_manifest(output_dir, manifest)
+
+    if max_segments and len(segments) > max_segments:
+        merge_segments(output_dir)
+    if shards:
+        split_segments(output_dir, shards)
+
+
+def LoadIndexForAppend(output_dir, list_doc_no, lexicon, list_doc_lengths):
+    with open('mapping.json', 'r') as json_file:
+        list_doc_no.extend(json.load(json_file)["doc_nos"])
+
+    with open(os.path.join(output_dir,'lexicon.json'), 'r') as file:
+        lexicon.update(json.load(file))
+
+    with open(os.path.join(output_dir,'doc-lengths.txt'), 'r') as file:
+        for line in file:
+            list_doc_lengths.append(int(line.strip()))
+
+    if len(list_doc_no) != len(list_doc_lengths):
+        raise ValueError("mapping.json does not match the index being appended to, run the append from the directory the index was built in.")
+
+
+def LoadStemMap(directory_path):
+    stem_map_path = os.path.join(directory_path, STEM_MAP_FILE)
+    if not os.path.exists(stem_map_path):
+        return {}
+    with open(stem_map_path, 'r') as file:
+        return json.load(file)
+
+
+def ReadDocuments(file_path, doc_store, metadata, list_doc_no):
+    """
+    Parses the TREC formatted gzip file, stores the raw document in the document
+    store and its metadata in the metadata store and yields the text of each
+    document that should be tokenized, in docno order.
+    """
     with gzip.open(file_path, "rt") as f:
         string_buffer = []
         string_buffer_headline = []
@@ -33,38 +191,24 @@ def unzip_file_and_read(file_path, output_dir, use_stemming=False):
         in_text = False
         in_graphic = False
         in_headline = False
-        internal_id = 0
         doc_no = None
-        dict_temp = {"internal_id": "", "date": "", "headline":""}
+        date_obj = None
+        headline = ""
 
         for line in f:
             string_buffer.append(line)
-            if "<DOC>" in line:
-                dict_temp["internal_id"] = internal_id
 
             if "<DOCNO>" in line:
                 doc_no = line.replace("<DOCNO>", "").replace("</DOCNO>", "").strip()
                 list_doc_no.append(doc_no)
                 date = doc_no.split("-")[0].replace("LA", "")
                 date_obj = datetime.strptime(date, "%m%d%y")
-                dict_temp["date"] = date_obj.strftime("%B %-d, %Y")
-                date_list = list(date)
-
-                year_path = os.path.join(current_directory, date_list[4]+date_list[5])
-                os.makedirs(year_path, exist_ok=True)
-
-                month_path = os.path.join(year_path, date_list[0]+date_list[1])
-                os.makedirs(month_path, exist_ok=True)
-
-                day_path = os.path.join(month_path, date_list[2]+date_list[3])
-                os.makedirs(day_path, exist_ok=True)
             
             if "<HEADLINE>" in line:
                 in_headline = True
 
             if "</HEADLINE>" in line:
-                headline = "".join(string_buffer_headline)
-                dict_temp["headline"] = re.sub(r'[\s\n]+', ' ', headline).strip()
+                headline = re.sub(r'[\s\n]+', ' ', "".join(string_buffer_headline)).strip()
                 in_headline = False
             
             if "<TEXT>" in line:
@@ -93,53 +237,177 @@ def unzip_file_and_read(file_path, output_dir, use_stemming=False):
                     string_buffer_important_content.append(line)
 
             if "</DOC>" in line:
-                if not string_buffer_headline:
-                    dict_temp["headline"] = ""
-                content = "".join(string_buffer)  
-                full_file_path = os.path.join(day_path, doc_no + ".txt")
-                with open(full_file_path, "w") as file:
-                    file.write(content)
+                doc_store.add("".join(string_buffer))
                 
-                meta_data_path = os.path.join(metadata_dir, doc_no+'.json')
-                with open(meta_data_path, 'w') as fp:
-                    json.dump(dict_temp, fp)
+                metadata.add(doc_no, date_obj, headline)
                 
-                filtered_content = "".join(string_buffer_important_content)
-
-                tokens = []
-
-                TokenizeStrings(filtered_content.split(" "), tokens, stemmer)
-
-                list_doc_lengths.append(len(tokens))
-
-                token_ids = ConvertTokensToIds(tokens, lexicon)
-
-                word_counts = CountWords(token_ids)
-
-                AddToPostings(word_counts, internal_id, inverted_index)
+                yield "".join(string_buffer_important_content)
 
                 string_buffer = []
                 string_buffer_headline = []
                 string_buffer_important_content = []
-                dict_temp = {}
                 doc_no = None
-                internal_id += 1
-    
-    data = {'doc_nos': list_doc_no}
-    
-    with open('mapping.json', 'w') as json_file:
-        json.dump(data, json_file, indent=4)
-    
-    
-    with open(os.path.join(output_dir,'doc-lengths.txt'), 'w') as file:
-        for length in list_doc_lengths:
-            file.write(f"{length}\n")
-    
-    with open(os.path.join(output_dir,'lexicon.json'), 'w') as file:
-        json.dump(lexicon, file, indent=4)
-    
-    with open(os.path.join(output_dir,'inverted-index.json'), 'w') as file:
-        json.dump(inverted_index, file, indent=4)
+                date_obj = None
+                headline = ""
+
+
+def IndexDocumentsInParallel(documents, lexicon, inverted_index, positional_index, list_doc_lengths, runs, stem_map, use_stemming, workers, batch_size):
+    """
+    Tokenizes batches of documents in a process pool. Each worker builds a partial
+    lexicon and inverted index with batch local ids and the batches are merged in
+    document order, so the output is identical to indexing on a single core.
+    """
+    pending = deque()
+    with Pool(workers, initializer=InitIndexWorker, initargs=(use_stemming, stem_map, positional_index is not None)) as pool:
+        for batch in BatchDocuments(documents, batch_size):
+            pending.append(pool.apply_async(IndexBatch, (batch,)))
+            if len(pending) >= 2 * workers:
+                num_postings, num_position_bytes = MergeBatch(pending.popleft().get(), lexicon, inverted_index, positional_index, list_doc_lengths, stem_map)
+                runs.add(num_postings, inverted_index, num_position_bytes)
+        while pending:
+            num_postings, num_position_bytes = MergeBatch(pending.popleft().get(), lexicon, inverted_index, positional_index, list_doc_lengths, stem_map)
+            runs.add(num_postings, inverted_index, num_position_bytes)
+
+
+def BatchDocuments(documents, batch_size):
+    batch = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+worker_stemmer = None
+worker_positions = False
+
+
+def InitIndexWorker(use_stemming, stem_map, positions):
+    global worker_stemmer, worker_positions
+    worker_stemmer = CachedStemmer(max_size=None, stem_map=stem_map, record_new_stems=True) if use_stemming else None
+    worker_positions = positions
+
+
+def IndexBatch(batch):
+    lexicon = {}
+    inverted_index = {}
+    positional_index = {} if worker_positions else None
+    doc_lengths = []
+    for doc_id, filtered_content in enumerate(batch):
+        tokens = []
+        TokenizeText(filtered_content, tokens, worker_stemmer)
+        doc_lengths.append(len(tokens))
+        token_ids = ConvertTokensToIds(tokens, lexicon)
+        AddToPostings(CountWords(token_ids), doc_id, inverted_index)
+        if positional_index is not None:
+            AddToPositionalIndex(CollectPositions(token_ids), positional_index)
+    new_stems = worker_stemmer.take_new_stems() if worker_stemmer else {}
+    return list(lexicon), inverted_index, positional_index, doc_lengths, new_stems
+
+
+def MergeBatch(batch_index, lexicon, inverted_index, positional_index, list_doc_lengths, stem_map):
+    terms, batch_inverted_index, batch_positional_index, doc_lengths, new_stems = batch_index
+    stem_map.update(new_stems)
+    first_doc_id = len(list_doc_lengths)
+    term_ids = ConvertTokensToIds(terms, lexicon)
+    num_postings = 0
+    for batch_term_id, postings in batch_inverted_index.items():
+        num_postings += len(postings) // 2
+        for i in range(0, len(postings), 2):
+            postings[i] += first_doc_id
+        term_id = term_ids[batch_term_id]
+        if term_id in inverted_index:
+            inverted_index[term_id].extend(postings)
+        else:
+            inverted_index[term_id] = postings
+    num_position_bytes = 0
+    if positional_index is not None:
+        for batch_term_id, data in batch_positional_index.items():
+            num_position_bytes += len(data)
+            term_id = term_ids[batch_term_id]
+            if term_id in positional_index:
+                positional_index[term_id].extend(data)
+            else:
+                positional_index[term_id] = data
+    list_doc_lengths.extend(doc_lengths)
+    return num_postings, num_position_bytes
+
+
+class IndexRuns:
+    """
+    Keeps track of the size of the in-memory inverted index. When the memory
+    budget (in MB) is hit, the postings are flushed to disk as a run sorted by
+    term id, and all runs are k-way merged into the final postings file. The
+    positional index, if one is built, is flushed and merged alongside it.
+    """
+
+    def __init__(self, output_dir, memory_budget=None, positional_index=None):
+        self.runs_dir = os.path.join(output_dir, "runs")
+        self.budget = memory_budget * 1024 * 1024 if memory_budget else None
+        self.positional_index = positional_index
+        self.run_paths = []
+        self.position_run_paths = []
+        self.postings_in_memory = 0
+        self.position_bytes_in_memory = 0
+
+    def add(self, num_postings, inverted_index, num_position_bytes=0):
+        self.postings_in_memory += num_postings
+        self.position_bytes_in_memory += num_position_bytes
+        memory = self.postings_in_memory * POSTING_BYTES + len(inverted_index) * TERM_BYTES + self.position_bytes_in_memory
+        if self.budget and memory > self.budget:
+            self.flush(inverted_index)
+
+    def flush(self, inverted_index):
+        os.makedirs(self.runs_dir, exist_ok=True)
+        run_path = os.path.join(self.runs_dir, f"run-{len(self.run_paths):04d}.bin")
+        write_run(inverted_index, run_path)
+        self.run_paths.append(run_path)
+        inverted_index.clear()
+        self.postings_in_memory = 0
+        if self.positional_index is not None:
+            position_run_path = os.path.join(self.runs_dir, f"positions-{len(self.position_run_paths):04d}.bin")
+            write_encoded_run(self.positional_index, position_run_path)
+            self.position_run_paths.append(position_run_path)
+            self.positional_index.clear()
+            self.position_bytes_in_memory = 0
+
+    def write_index(self, inverted_index, num_terms, path):
+        positions_path = os.path.join(os.path.dirname(path), positions_file_for(os.path.basename(path)))
+        if not self.run_paths:
+            write_inverted_index(inverted_index, num_terms, path)
+            if self.positional_index is not None:
+                write_positional_index(self.positional_index, num_terms, positions_path)
+            return
+        if inverted_index:
+            self.flush(inverted_index)
+        merge_runs(self.run_paths, num_terms, path)
+        if self.positional_index is not None:
+            merge_position_runs(self.position_run_paths, num_terms, positions_path)
+        shutil.rmtree(self.runs_dir)
+
+
+def CollectPositions(token_ids):
+    positions = {}
+    for position, token_id in enumerate(token_ids):
+        if token_id in positions:
+            positions[token_id].append(position)
+        else:
+            positions[token_id] = [position]
+    return positions
+
+
+def AddToPositionalIndex(positions, positional_index):
+    num_bytes = 0
+    for term_id, term_positions in positions.items():
+        if term_id not in positional_index:
+            positional_index[term_id] = bytearray()
+        data = positional_index[term_id]
+        size = len(data)
+        encode_positions(term_positions, data)
+        num_bytes += len(data) - size
+    return num_bytes
 
 
 def AddToPostings(word_counts, doc_id, inverted_index):
@@ -178,6 +446,42 @@ def ConvertTokensToIds(tokens, lexicon):
 
 
 def Tokenize(text, tokens):
+    """
+    Splits text into lower cased runs of letters and digits in one regex pass,
+    giving the same tokens as TokenizeCharByChar. ASCII text, which is all of
+    LA Times, only needs [a-z0-9]. Otherwise [^\W_] matches str.isalnum(),
+    which also accepts numeric characters that are neither alpha nor digit,
+    so tokens containing those are split again character by character.
+    """
+    lowered = text.lower()
+    if lowered.isascii():
+        tokens.extend(TOKEN_PATTERN.findall(lowered))
+    else:
+        tokens.extend(IterLoweredTokens(lowered))
+
+
+def IterTokens(text):
+    lowered = text.lower()
+    if lowered.isascii():
+        yield from TOKEN_PATTERN.findall(lowered)
+        return
+    yield from IterLoweredTokens(lowered)
+
+
+def IterLoweredTokens(lowered):
+    """
+    Yields the tokens of text that is already lower cased and not ASCII.
+    """
+    for token in UNICODE_TOKEN_PATTERN.findall(lowered):
+        if token.isascii() or all(char.isalpha() or char.isdigit() for char in token):
+            yield token
+        else:
+            split_tokens = []
+            TokenizeCharByChar(token, split_tokens)
+            yield from split_tokens
+
+
+def TokenizeCharByChar(text, tokens):
     text = text.lower() 
 
     start = 0 
@@ -204,6 +508,69 @@ def TokenizeStrings(strings, tokens, stemmer=None):
         tokens[:] = [stemmer.stem(token, 0, len(token) - 1) for token in tokens]
 
 
+class CachedStemmer:
+    """
+    Porter stemmer with a bounded LRU cache of word -> stem. The vocabulary is
+    tiny compared to the number of tokens, so almost every token is a cache hit.
+    The cache can be preloaded with the stem map saved next to a stemmed index.
+    max_size=None keeps every word, which is what the indexer uses to build
+    that stem map.
+    """
+
+    def __init__(self, max_size=STEM_CACHE_SIZE, stem_map=None, record_new_stems=False):
+        self.stemmer = PorterStemmer()
+        self.max_size = max_size
+        self.cache = OrderedDict()
+        self.new_stems = {} if record_new_stems else None
+        if stem_map:
+            for word, stem in stem_map.items():
+                if self.max_size and len(self.cache) >= self.max_size:
+                    break
+                self.cache[word] = stem
+
+    @classmethod
+    def from_index(cls, directory_path, max_size=STEM_CACHE_SIZE):
+        return cls(max_size=max_size, stem_map=LoadStemMap(directory_path))
+
+    def stem(self, p, i, j):
+        if i != 0 or j != len(p) - 1:
+            return self.stemmer.stem(p, i, j)
+        return self.stem_word(p)
+
+    def stem_word(self, word):
+        stem = self.cache.get(word)
+        if stem is not None:
+            if self.max_size:
+                self.cache.move_to_end(word)
+            return stem
+        stem = self.stemmer.stem(word, 0, len(word) - 1)
+        if self.max_size and len(self.cache) >= self.max_size:
+            self.cache.popitem(last=False)
+        self.cache[word] = stem
+        if self.new_stems is not None:
+            self.new_stems[word] = stem
+        return stem
+
+    def take_new_stems(self):
+        new_stems = self.new_stems
+        self.new_stems = {}
+        return new_stems
+
+
+def TokenizeText(text, tokens, stemmer=None):
+    """
+    Same tokens as TokenizeStrings(text.split(" "), ...), since spaces are
+    separators anyway, but tokenizes the whole text in one pass.
+    """
+    TokenizeStrings([text], tokens, stemmer)
+
+
+def TokenizeSentence(sentence, stemmer=None):
+    tokens = []
+    TokenizeText(sentence, tokens, stemmer)
+    return tokens
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Process latimes.gz file and store documents and metadata.')
 
@@ -213,7 +580,29 @@ if __name__ == "__main__":
                         help='Path to the output directory where documents and metadata will be stored')
     parser.add_argument('--use_stemming', action='store_true',
                         help='If set, the tokens will be stemmed using Porter Stemmer.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes used to tokenize and count the documents.')
+    parser.add_argument('--batch_size', type=int, default=1000,
+                        help='Number of documents handed to a worker process at a time.')
+    parser.add_argument('--memory_budget', type=float, default=None,
+                        help='Memory budget in MB for the in-memory postings, partial indexes are flushed to disk and merged when it is hit.')
+    parser.add_argument('--append', action='store_true',
+                        help='If set, the documents are added as a new segment of the existing index in output_dir.')
+    parser.add_argument('--max_segments', type=int, default=None,
+                        help='If set, all segments are merged into one once the index has more than this many segments.')
+    parser.add_argument('--positions', action='store_true',
+                        help='If set, token positions are stored in positions.bin so phrase queries can be answered.')
+    parser.add_argument('--impacts', action='store_true',
+                        help='If set, an impact ordered index (impacts.bin) is also built for the anytime BM25 mode.')
+    parser.add_argument('--shards', type=int, default=None,
+                        help='If set, the postings are split into this many segments of consecutive documents that ShardedSearch.py searches in parallel.')
+    parser.add_argument('--sentences', action='store_true',
+                        help='If set, a sentence table (sentences.bin) of every document is also built, so snippets are scored without tokenizing the documents.')
+    parser.add_argument('--k1', type=float, default=1.2,
+                        help='BM25 k1 used for the precomputed document length normalisation.')
+    parser.add_argument('--b', type=float, default=0.75,
+                        help='BM25 b used for the precomputed document length normalisation.')
 
     args = parser.parse_args()
 
-    unzip_file_and_read(args.input_file, args.output_dir, use_stemming=args.use_stemming)
+    unzip_file_and_read(args.input_file, args.output_dir, use_stemming=args.use_stemming, workers=args.workers, batch_size=args.batch_size, memory_budget=args.memory_budget, append=args.append, max_segments=args.max_segments, positions=args.positions, k1=args.k1, b=args.b, impacts=args.impacts, shards=args.shards, sentences=args.sentences)
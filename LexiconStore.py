@@ -0,0 +1,102 @@
+import os
+import json
+import mmap
+import struct
+from array import array
+from HashTable import build_hash_table, map_hash_table, lookup
+
+LEXICON_FILE = "lexicon.bin"
+LEXICON_JSON_FILE = "lexicon.json"
+MAGIC = b"LEXICON1"
+# magic, number of terms, hash table size
+HEADER = struct.Struct("<8sQQ")
+
+
+def write_lexicon_store(path, lexicon):
+    """
+    Writes the {token: term_id} lexicon as term offsets indexed by term id,
+    an open addressing token -> term id hash table and the utf-8 tokens in
+    term id order, so it can be memory-mapped instead of parsed. The store is
+    written next to the old one and replaces it, so the lexicon of a running
+    engine keeps its memory-mapped file.
+    """
+    terms = [None] * len(lexicon)
+    for token, term_id in lexicon.items():
+        terms[term_id] = token.encode("utf-8")
+
+    table = build_hash_table(terms)
+    term_offsets = array("Q", [0])
+    for term in terms:
+        term_offsets.append(term_offsets[-1] + len(term))
+
+    with open(path + ".tmp", "wb") as file:
+        file.write(HEADER.pack(MAGIC, len(terms), len(table)))
+        term_offsets.tofile(file)
+        table.tofile(file)
+        file.write(b"".join(terms))
+    os.replace(path + ".tmp", path)
+
+
+class LexiconStore:
+    """
+    Memory-maps the lexicon store. Supports the lookups the retrieval code
+    does on the lexicon dictionary (token in lexicon, lexicon[token]) in
+    constant time, without loading the lexicon.
+    """
+
+    def __init__(self, path):
+        if not os.path.exists(path):
+            raise ValueError(f"No lexicon store found at {path}")
+        self.file = open(path, "rb")
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.num_terms, self.table_size = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a lexicon store")
+        view = memoryview(self.buffer)
+        offset = HEADER.size
+        self.term_offsets = view[offset:offset + (self.num_terms + 1) * 8].cast("Q")
+        offset += (self.num_terms + 1) * 8
+        self.table = map_hash_table(view, offset, self.table_size)
+        self.terms_offset = offset + self.table_size * 4
+
+    def __len__(self):
+        return self.num_terms
+
+    def term_bytes(self, term_id):
+        start = self.terms_offset + self.term_offsets[term_id]
+        end = self.terms_offset + self.term_offsets[term_id + 1]
+        return self.buffer[start:end]
+
+    def term(self, term_id):
+        return self.term_bytes(term_id).decode("utf-8")
+
+    def get(self, token, default=None):
+        term_id = lookup(self.table, token.encode("utf-8"), self.term_bytes)
+        return default if term_id is None else term_id
+
+    def __contains__(self, token):
+        return self.get(token) is not None
+
+    def __getitem__(self, token):
+        term_id = self.get(token)
+        if term_id is None:
+            raise KeyError(token)
+        return term_id
+
+    def close(self):
+        self.term_offsets.release()
+        self.table.release()
+        self.buffer.close()
+        self.file.close()
+
+
+def open_lexicon(directory_path):
+    """
+    Returns the memory-mapped lexicon store of the index, or the parsed
+    lexicon.json of indexes built before the store existed.
+    """
+    store_path = os.path.join(directory_path, LEXICON_FILE)
+    if os.path.exists(store_path):
+        return LexiconStore(store_path)
+    with open(os.path.join(directory_path, LEXICON_JSON_FILE), "r") as file:
+        return json.load(file)
@@ -0,0 +1,225 @@
+import os
+import mmap
+import struct
+from array import array
+from bisect import bisect_right
+from datetime import datetime
+from functools import lru_cache
+from itertools import accumulate
+from HashTable import build_hash_table, map_hash_table, lookup
+
+METADATA_FILE = "metadata.bin"
+# documents appended to the index go to metadata-0001.bin, metadata-0002.bin, ...
+METADATA_PART_FILE = "metadata-{:04d}.bin"
+MAGIC = b"METADAT1"
+# magic, number of documents, docno width, hash table size
+HEADER = struct.Struct("<8sQQQ")
+
+
+def metadata_part_paths(directory_path):
+    """
+    Returns the paths of the parts of the metadata store, in internal id order.
+    """
+    paths = [os.path.join(directory_path, METADATA_FILE)]
+    while os.path.exists(os.path.join(directory_path, METADATA_PART_FILE.format(len(paths)))):
+        paths.append(os.path.join(directory_path, METADATA_PART_FILE.format(len(paths))))
+    return paths
+
+
+def write_metadata_store(path, doc_nos, dates, headlines):
+    """
+    Writes the metadata of all documents as columns indexed by internal id:
+    headline offsets, an open addressing docno -> internal id hash table, the
+    dates as YYYYMMDD integers, the fixed width docnos and the headline text.
+
+    Parameters:
+    - doc_nos: The docno of each document in internal id order.
+    - dates: A datetime (or None) for each document.
+    - headlines: The headline of each document.
+    """
+    num_docs = len(doc_nos)
+    encoded_doc_nos = [doc_no.encode("ascii") for doc_no in doc_nos]
+    docno_width = max((len(doc_no) for doc_no in encoded_doc_nos), default=0)
+
+    table = build_hash_table(encoded_doc_nos)
+
+    headline_offsets = array("Q", [0])
+    headline_blob = bytearray()
+    for headline in headlines:
+        headline_blob.extend(headline.encode("utf-8"))
+        headline_offsets.append(len(headline_blob))
+
+    date_column = array("I", [int(date.strftime("%Y%m%d")) if date else 0 for date in dates])
+
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, num_docs, docno_width, len(table)))
+        headline_offsets.tofile(file)
+        table.tofile(file)
+        date_column.tofile(file)
+        file.write(b"".join(doc_no.ljust(docno_width, b"\0") for doc_no in encoded_doc_nos))
+        file.write(headline_blob)
+
+
+class MetaDataWriter:
+    """
+    Collects the metadata of the documents while indexing and writes it on
+    close. When appending, the new documents are written to a new part of
+    the store, so the existing parts are neither read nor rewritten.
+    """
+
+    def __init__(self, directory_path, append=False):
+        self.path = os.path.join(directory_path, METADATA_FILE)
+        if append:
+            self.path = os.path.join(directory_path, METADATA_PART_FILE.format(len(metadata_part_paths(directory_path))))
+        self.append = append
+        self.doc_nos = []
+        self.dates = []
+        self.headlines = []
+
+    def add(self, doc_no, date, headline):
+        self.doc_nos.append(doc_no)
+        self.dates.append(date)
+        self.headlines.append(headline)
+
+    def close(self):
+        if self.append and not self.doc_nos:
+            return
+        write_metadata_store(self.path, self.doc_nos, self.dates, self.headlines)
+
+
+class MetaDataPart:
+    """
+    Memory-maps one part of the metadata store, whose ids start at 0. Lookups
+    from id to docno, date and headline and from docno to id are constant time.
+    """
+
+    def __init__(self, path):
+        if not os.path.exists(path):
+            raise ValueError(f"No metadata store found at {path}")
+        self.file = open(path, "rb")
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.num_docs, self.docno_width, self.table_size = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a metadata store")
+        view = memoryview(self.buffer)
+        offset = HEADER.size
+        self.headline_offsets = view[offset:offset + (self.num_docs + 1) * 8].cast("Q")
+        offset += (self.num_docs + 1) * 8
+        self.table = map_hash_table(view, offset, self.table_size)
+        offset += self.table_size * 4
+        self.dates = view[offset:offset + self.num_docs * 4].cast("I")
+        offset += self.num_docs * 4
+        self.docnos_offset = offset
+        self.headlines_offset = offset + self.num_docs * self.docno_width
+
+    def __len__(self):
+        return self.num_docs
+
+    def check_id(self, doc_id):
+        if not 0 <= doc_id < self.num_docs:
+            raise ValueError(f"The internal id {doc_id} does not exist in the metadata store")
+
+    def docno_bytes(self, doc_id):
+        start = self.docnos_offset + doc_id * self.docno_width
+        return self.buffer[start:start + self.docno_width].rstrip(b"\0")
+
+    def docno(self, doc_id):
+        self.check_id(doc_id)
+        return self.docno_bytes(doc_id).decode("ascii")
+
+    def doc_id(self, doc_no):
+        """
+        Returns the internal id of a docno, or None if the docno is not in the store.
+        """
+        doc_no_bytes = doc_no.encode("ascii", errors="replace")
+        if len(doc_no_bytes) > self.docno_width:
+            return None
+        return lookup(self.table, doc_no_bytes, self.docno_bytes)
+
+    def date_object(self, doc_id):
+        self.check_id(doc_id)
+        date = self.dates[doc_id]
+        return datetime.strptime(str(date), "%Y%m%d") if date else None
+
+    def date(self, doc_id):
+        date = self.date_object(doc_id)
+        return date.strftime("%B %-d, %Y") if date else ""
+
+    def headline(self, doc_id):
+        self.check_id(doc_id)
+        start = self.headlines_offset + self.headline_offsets[doc_id]
+        end = self.headlines_offset + self.headline_offsets[doc_id + 1]
+        return self.buffer[start:end].decode("utf-8")
+
+    def get(self, doc_id):
+        return {"internal_id": doc_id, "date": self.date(doc_id), "headline": self.headline(doc_id)}
+
+    def close(self):
+        self.headline_offsets.release()
+        self.table.release()
+        self.dates.release()
+        self.buffer.close()
+        self.file.close()
+
+
+class MetaDataStore:
+    """
+    The metadata of all documents by internal id: the parts of the store, one
+    per batch of documents indexed, each holding the ids following the last
+    one of the part before.
+    """
+
+    def __init__(self, directory_path):
+        self.parts = [MetaDataPart(path) for path in metadata_part_paths(directory_path)]
+        self.first_doc_ids = list(accumulate((len(part) for part in self.parts[:-1]), initial=0))
+        self.num_docs = sum(len(part) for part in self.parts)
+
+    def __len__(self):
+        return self.num_docs
+
+    def locate(self, doc_id):
+        """
+        Returns the part holding the internal id and the id within the part.
+        """
+        if not 0 <= doc_id < self.num_docs:
+            raise ValueError(f"The internal id {doc_id} does not exist in the metadata store")
+        index = bisect_right(self.first_doc_ids, doc_id) - 1
+        return self.parts[index], doc_id - self.first_doc_ids[index]
+
+    def docno(self, doc_id):
+        part, part_doc_id = self.locate(doc_id)
+        return part.docno(part_doc_id)
+
+    def doc_id(self, doc_no):
+        """
+        Returns the internal id of a docno, or None if the docno is not in the store.
+        """
+        for part, first_doc_id in zip(self.parts, self.first_doc_ids):
+            doc_id = part.doc_id(doc_no)
+            if doc_id is not None:
+                return first_doc_id + doc_id
+        return None
+
+    def date_object(self, doc_id):
+        part, part_doc_id = self.locate(doc_id)
+        return part.date_object(part_doc_id)
+
+    def date(self, doc_id):
+        part, part_doc_id = self.locate(doc_id)
+        return part.date(part_doc_id)
+
+    def headline(self, doc_id):
+        part, part_doc_id = self.locate(doc_id)
+        return part.headline(part_doc_id)
+
+    def get(self, doc_id):
+        return {"internal_id": doc_id, "date": self.date(doc_id), "headline": self.headline(doc_id)}
+
+    def close(self):
+        for part in self.parts:
+            part.close()
+
+
+@lru_cache(maxsize=None)
+def open_metadata_store(directory_path):
+    return MetaDataStore(directory_path)
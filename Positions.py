@@ -0,0 +1,148 @@
+import os
+import re
+from BinaryIndex import PostingsWriter, PostingsReader, encode_vbyte, read_vbyte, merge_run_entries, read_manifest, positions_file_for, MANIFEST_FILE, POSITIONS_MAGIC
+
+POSITIONS_FILE = "positions.bin"
+PHRASE_PATTERN = re.compile(r'"([^"]*)"')
+
+
+def encode_positions(positions, out):
+    """
+    Appends the positions of a term in one document as gaps, prefixed with
+    their byte length so readers can skip documents without decoding them.
+    """
+    gaps = bytearray()
+    previous = 0
+    for position in positions:
+        encode_vbyte(position - previous, gaps)
+        previous = position
+    encode_vbyte(len(gaps), out)
+    out.extend(gaps)
+
+
+def decode_positions(data, start, end):
+    positions = []
+    position = 0
+    offset = start
+    while offset < end:
+        gap, offset = read_vbyte(data, offset)
+        position += gap
+        positions.append(position)
+    return positions
+
+
+def write_positional_index(positional_index, num_terms, path):
+    with PostingsWriter(path, magic=POSITIONS_MAGIC) as writer:
+        for term_id in range(num_terms):
+            writer.add_encoded(positional_index.get(term_id, b""), 0)
+
+
+def merge_position_runs(run_paths, num_terms, path):
+    with PostingsWriter(path, magic=POSITIONS_MAGIC) as writer:
+        next_term_id = 0
+        for term_id, entries in merge_run_entries(run_paths):
+            while next_term_id < term_id:
+                writer.add_encoded(b"", 0)
+                next_term_id += 1
+            writer.add_encoded(b"".join(entries), 0)
+            next_term_id += 1
+        while next_term_id < num_terms:
+            writer.add_encoded(b"", 0)
+            next_term_id += 1
+
+
+class PositionsReader:
+    """
+    Reads the positions of a term for selected postings. The positions of every
+    posting are length prefixed, so the postings that are not requested are
+    skipped by reading one integer instead of decoding their positions.
+    """
+
+    def __init__(self, readers):
+        self.readers = readers
+
+    def positions(self, term_id, posting_indexes):
+        """
+        Returns {posting index: [positions]} for the sorted posting indexes of
+        the term, where the posting index is the rank of the document in the
+        term's posting list.
+        """
+        found = {}
+        wanted = iter(posting_indexes)
+        target = next(wanted, None)
+        posting_index = 0
+        for reader in self.readers:
+            data = reader.encoded(term_id)
+            offset = 0
+            while target is not None and offset < len(data):
+                length, offset = read_vbyte(data, offset)
+                if posting_index == target:
+                    found[target] = decode_positions(data, offset, offset + length)
+                    target = next(wanted, None)
+                offset += length
+                posting_index += 1
+        return found
+
+    def close(self):
+        for reader in self.readers:
+            reader.close()
+
+
+def open_positions(directory_path):
+    """
+    Returns a PositionsReader for an index built with positions, or None.
+    """
+    if os.path.exists(os.path.join(directory_path, MANIFEST_FILE)):
+        manifest = read_manifest(directory_path)
+        if not manifest.get("positions"):
+            return None
+        segments = [positions_file_for(segment) for segment in manifest["segments"]]
+    elif os.path.exists(os.path.join(directory_path, POSITIONS_FILE)):
+        segments = [POSITIONS_FILE]
+    else:
+        return None
+    return PositionsReader([PostingsReader(os.path.join(directory_path, segment), magic=POSITIONS_MAGIC) for segment in segments])
+
+
+def split_phrases(query_text):
+    """
+    Returns the text of every "quoted phrase" in the query.
+    """
+    return [phrase for phrase in PHRASE_PATTERN.findall(query_text) if phrase.strip()]
+
+
+def find_phrase_matches(phrase_term_ids, inverted_index, positions_reader):
+    """
+    Returns the set of doc ids in which the terms occur next to each other in
+    order. Documents are first intersected on their doc ids and positions are
+    only decoded for the documents that contain every term.
+    """
+    unique_term_ids = list(dict.fromkeys(phrase_term_ids))
+    postings_lists = {term_id: inverted_index.postings(term_id) for term_id in unique_term_ids}
+
+    candidates = None
+    for term_id in sorted(unique_term_ids, key=lambda term_id: len(postings_lists[term_id])):
+        doc_ids = set(postings_lists[term_id][::2])
+        candidates = doc_ids if candidates is None else candidates & doc_ids
+        if not candidates:
+            return set()
+    if len(phrase_term_ids) == 1:
+        return candidates
+
+    positions_by_doc = {}
+    for term_id in unique_term_ids:
+        postings = postings_lists[term_id]
+        posting_indexes = [i // 2 for i in range(0, len(postings), 2) if postings[i] in candidates]
+        term_positions = positions_reader.positions(term_id, posting_indexes)
+        for posting_index, positions in term_positions.items():
+            positions_by_doc.setdefault(postings[posting_index * 2], {})[term_id] = set(positions)
+
+    matches = set()
+    for doc_id in candidates:
+        doc_positions = positions_by_doc[doc_id]
+        first_positions = doc_positions[phrase_term_ids[0]]
+        for start in first_positions:
+            if all(start + offset in doc_positions[term_id] for offset, term_id in enumerate(phrase_term_ids[1:], start=1)):
+                matches.add(doc_id)
+                break
+    return matches
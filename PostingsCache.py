@@ -0,0 +1,122 @@
+import json
+from array import array
+from collections import Counter, OrderedDict
+from BinaryIndex import decode_postings_arrays
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# every cached posting is a (doc_id, count) pair of 4 byte unsigned ints
+POSTING_BYTES = 8
+
+
+class CachedPostingsReader:
+    """
+    Wraps a postings reader and keeps the decoded posting lists of the most
+    recently used terms under a byte budget, so the lists of frequent query
+    terms are decoded once instead of on every query. Lists are returned as
+    array("I") in the interleaved [doc_id, count, ...] form, 4 bytes per
+    value, whether they came from the cache or not.
+    """
+
+    def __init__(self, reader, max_bytes):
+        self.reader = reader
+        self.max_bytes = max_bytes
+        self.lists = OrderedDict()
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.reader)
+
+    def doc_frequency(self, term_id):
+        return self.reader.doc_frequency(term_id)
+
+    def encoded_lists(self, term_id):
+        return self.reader.encoded_lists(term_id)
+
+    def postings(self, term_id):
+        postings = self.lists.get(term_id)
+        if postings is not None:
+            self.lists.move_to_end(term_id)
+            self.hits += 1
+            return postings
+        self.misses += 1
+        return self.load(term_id)
+
+    def load(self, term_id):
+        """
+        Decodes the posting list of the term and caches it, evicting the least
+        recently used lists until it fits. Lists larger than the whole budget
+        are not cached.
+        """
+        postings = self.decode(term_id)
+        size = len(postings) * postings.itemsize
+        if size > self.max_bytes:
+            return postings
+        self.lists[term_id] = postings
+        self.num_bytes += size
+        while self.num_bytes > self.max_bytes:
+            _, evicted = self.lists.popitem(last=False)
+            self.num_bytes -= len(evicted) * evicted.itemsize
+        return postings
+
+    def decode(self, term_id):
+        if np is None:
+            return array("I", self.reader.postings(term_id))
+        arrays = [decode_postings_arrays(data) for data in self.reader.encoded_lists(term_id) if data]
+        postings = array("I")
+        if arrays:
+            interleaved = np.empty(2 * sum(len(doc_ids) for doc_ids, _ in arrays), dtype=np.uint32)
+            interleaved[0::2] = np.concatenate([doc_ids for doc_ids, _ in arrays])
+            interleaved[1::2] = np.concatenate([frequencies for _, frequencies in arrays])
+            postings.frombytes(interleaved.tobytes())
+        return postings
+
+    def warm_up(self, queries, lexicon, tokenize):
+        """
+        Loads the posting lists of the terms occurring most often in a query
+        log, as many as fit in the budget, most frequent first.
+
+        Parameters:
+        - queries: The query texts of the log.
+        - lexicon: The {token: term_id} dictionary of the index.
+        - tokenize: A function returning the tokens of a query text.
+        """
+        counts = Counter(lexicon[token] for query_text in queries for token in tokenize(query_text) if token in lexicon)
+        selected = []
+        total = 0
+        for term_id, _ in counts.most_common():
+            size = self.reader.doc_frequency(term_id) * POSTING_BYTES
+            if total + size <= self.max_bytes:
+                selected.append(term_id)
+                total += size
+        # loaded least frequent first, so the most frequent terms are evicted last
+        for term_id in reversed(selected):
+            if term_id not in self.lists:
+                self.load(term_id)
+
+    def close(self):
+        self.lists.clear()
+        self.num_bytes = 0
+        self.reader.close()
+
+
+def cache_postings(inverted_index, max_bytes, lexicon=None, tokenize=None, query_log_path=None):
+    """
+    Returns inverted_index wrapped in a CachedPostingsReader of max_bytes, or
+    inverted_index itself when max_bytes is 0. When query_log_path is given
+    (a {topic_number: query_text} JSON file like queries.json), the cache is
+    warmed up with the most frequent terms of its queries.
+    """
+    if not max_bytes:
+        return inverted_index
+    cached_index = CachedPostingsReader(inverted_index, max_bytes)
+    if query_log_path is not None:
+        with open(query_log_path, "r") as file:
+            queries = json.load(file)
+        cached_index.warm_up(queries.values(), lexicon, tokenize)
+    return cached_index
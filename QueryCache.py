@@ -0,0 +1,72 @@
+import sys
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+class QueryCache:
+    """
+    Least recently used cache of query results, bounded both by the number of
+    entries and by their estimated size in bytes. Every lookup carries the
+    version of the index; when it changes (documents were appended or the
+    segments merged) all cached results are dropped.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.num_bytes = 0
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def check_version(self, version):
+        if version != self.version:
+            self.clear()
+            self.version = version
+
+    def get(self, key, version):
+        """
+        Returns the cached value of key, or None.
+        """
+        self.check_version(version)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, version, value, size=None):
+        self.check_version(version)
+        if size is None:
+            size = estimate_size(value)
+        if size > self.max_bytes or self.max_entries <= 0:
+            return
+        if key in self.entries:
+            self.num_bytes -= self.entries.pop(key)[1]
+        self.entries[key] = (value, size)
+        self.num_bytes += size
+        while len(self.entries) > self.max_entries or self.num_bytes > self.max_bytes:
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.num_bytes -= evicted_size
+
+    def clear(self):
+        self.entries.clear()
+        self.num_bytes = 0
+
+
+def estimate_size(results):
+    """
+    Estimates the memory used by a list of result objects and their attributes.
+    """
+    size = sys.getsizeof(results)
+    for result in results:
+        size += sys.getsizeof(result) + sum(sys.getsizeof(value) for value in vars(result).values())
+    return size
@@ -1,85 +1,137 @@
-from BM25 import read_doc_lengths, read_json, bm_25
-from IndexEngine import unzip_file_and_read, TokenizeStrings
-from GetDoc import return_data, retrieve_data
+from BM25 import bm_25, tokenize_query
+from IndexEngine import unzip_file_and_read, CachedStemmer
+from GetDoc import retrieve_data
+from Snippets import find_and_add_snippets
+from BinaryIndex import open_inverted_index, read_manifest, MANIFEST_FILE
+from MetaDataStore import open_metadata_store
+from DocStore import open_doc_store
+from SentenceTable import open_sentence_table
+from Positions import open_positions, split_phrases
+from CollectionStats import load_collection_stats
+from ImpactIndex import open_impact_index
+from LexiconStore import open_lexicon
+from QueryCache import QueryCache, DEFAULT_MAX_ENTRIES, DEFAULT_MAX_BYTES
+from PostingsCache import cache_postings, CachedPostingsReader
+from functools import partial
 import os
-from math import sqrt, log
 import time
 import argparse
-import textwrap
-
-def create_and_load_data_structures():
+from concurrent.futures import ProcessPoolExecutor
+
+def timed_stage(stage, load, *args):
+    start_time = time.perf_counter()
+    loaded = load(*args)
+    print(f"  {stage}: {(time.perf_counter() - start_time) * 1000:.1f} ms")
+    return loaded
+
+def create_and_load_data_structures(use_stemming=False, postings_cache_bytes=0, warm_up=None, load_impacts=True):
+    """
+    Opens the index without parsing it: the lexicon, posting lists, metadata
+    and positions are memory-mapped and only read when a query needs them,
+    and the stemmer fills its cache as query words come in. The time of every
+    stage is printed. The index is only built when it does not exist yet.
+    """
     if not os.path.exists("IndexEngine"):
-        unzip_file_and_read("latimes.gz", "IndexEngine")
-    inverted_index = read_json("IndexEngine/inverted-index.json")
-    lexicon = read_json("IndexEngine/lexicon.json")
-    mapping_to_docno = read_json("mapping.json")["doc_nos"]
-    doc_lengths = read_doc_lengths("IndexEngine/doc-lengths.txt")
-    return inverted_index, lexicon, mapping_to_docno, doc_lengths
-
-def compute_tfidf_vector(tokens, sentence_tokens_list, num_sentences):
-    vector = {}
-    for token in tokens:
-        ni = sum(1 for sentence_tokens in sentence_tokens_list if token in sentence_tokens)
-        if ni > 0:
-            tf = tokens.count(token)  
-            idf = log((num_sentences + 1) / (1 + ni))  
-            vector[token] = tf * idf
-    return vector
-
-def cosine_similarity(vec1, vec2):
-    dot_product = sum(vec1[token] * vec2.get(token, 0) for token in vec1)
-    magnitude1 = sqrt(sum(weight ** 2 for weight in vec1.values()))
-    magnitude2 = sqrt(sum(weight ** 2 for weight in vec2.values()))
-    return dot_product / (magnitude1 * magnitude2) if magnitude1 and magnitude2 else 0
-
-def find_and_add_snippets(list_output, query, k=3):
-    for output in list_output:
-        doc_id = output.docno
-
-        doc_content = return_data(doc_id, "IndexEngine")
-        
-        sentences = doc_content.split(".")
-        num_sentences = len(sentences)
-        
-        sentence_tokens_list = []
-        for sentence in sentences:
-            tokens = []
-            TokenizeStrings(sentence.split(" "), tokens)
-            sentence_tokens_list.append(tokens)
-        
-        query_tokens = []
-        TokenizeStrings(query.split(" "), query_tokens)
-
-        query_vector = compute_tfidf_vector(query_tokens, sentence_tokens_list, num_sentences)
-        
-        sentence_similarities = []
-
-        for sentence, sentence_tokens in zip(sentences, sentence_tokens_list):
-
-            sentence_vector = compute_tfidf_vector(sentence_tokens, sentence_tokens_list, num_sentences)
-            
-            similarity = cosine_similarity(query_vector, sentence_vector)
-
-            sentence_similarities.append((sentence.strip(), similarity))
-        
-        top_k_sentences = sorted(sentence_similarities, key=lambda x: x[1], reverse=True)[:k]
-        
-        best_snippet = " ".join([sentence for sentence, _ in top_k_sentences])
-        best_snippet = best_snippet.replace("\n", "")
-        if not best_snippet.endswith(".") or not best_snippet.endswith("!") or not best_snippet.endswith("?"):
-            best_snippet += "."
-        if not output.headline:
-            output.headline = best_snippet[:50] + "..."
-        formatted_snippet = textwrap.fill(best_snippet, width=80)
-        output.add_snippet(formatted_snippet)
-
-
-def query_flow(inverted_index, lexicon, mapping_to_docno, doc_lengths):
+        timed_stage("index build (latimes.gz)", unzip_file_and_read, "latimes.gz", "IndexEngine", use_stemming)
+    lexicon = timed_stage("lexicon", open_lexicon, "IndexEngine")
+    inverted_index = timed_stage("postings", open_inverted_index, "IndexEngine")
+    metadata = timed_stage("metadata", open_metadata_store, "IndexEngine")
+    stats = timed_stage("collection statistics", load_collection_stats, "IndexEngine", inverted_index)
+    stemmer = CachedStemmer() if read_manifest("IndexEngine")["use_stemming"] else None
+    positions = timed_stage("positions", open_positions, "IndexEngine")
+    impacts = timed_stage("impacts", open_impact_index, "IndexEngine") if load_impacts else None
+    if postings_cache_bytes:
+        inverted_index = timed_stage("posting list cache", cache_postings, inverted_index, postings_cache_bytes, lexicon, partial(tokenize_query, ps=stemmer), warm_up)
+    return inverted_index, lexicon, metadata, stats, stemmer, positions, impacts
+
+class EngineIndex:
+    """
+    The index the interactive engine ranks on, with the snippet worker pool.
+    Before every query refresh() checks the segment manifest; when its
+    version changed (documents were appended or the segments merged) the
+    old readers and stores are closed and the index is opened again, with
+    the stores that are cached per directory and the snippet workers, so
+    queries are ranked on the new version. The manifest is only parsed when
+    its modification time changed.
+    """
+
+    def __init__(self, use_stemming=False, postings_cache_bytes=0, warm_up=None, load_impacts=True, snippet_workers=1):
+        self.load_args = (use_stemming, postings_cache_bytes, warm_up, load_impacts)
+        self.snippet_workers = snippet_workers
+        self.snippet_executor = None
+        self.load()
+
+    def load(self):
+        (self.inverted_index, self.lexicon, self.metadata, self.stats, self.stemmer,
+         self.positions, self.impacts) = create_and_load_data_structures(*self.load_args)
+        self.manifest_mtime = manifest_mtime()
+        self.version = read_manifest("IndexEngine")["version"]
+        if self.snippet_executor is not None:
+            self.snippet_executor.shutdown()
+        self.snippet_executor = ProcessPoolExecutor(self.snippet_workers) if self.snippet_workers > 1 else None
+
+    def refresh(self):
+        current_mtime = manifest_mtime()
+        if current_mtime == self.manifest_mtime:
+            return
+        self.manifest_mtime = current_mtime
+        if read_manifest("IndexEngine")["version"] == self.version:
+            return
+        print("The index changed, reopening it...")
+        self.close_stores()
+        self.load()
+
+    def close_stores(self):
+        for store in (self.inverted_index, self.lexicon, self.positions, self.impacts):
+            # indexes built before the lexicon store have a plain dictionary lexicon
+            if store is not None and not isinstance(store, dict):
+                store.close()
+        for open_cached in (open_metadata_store, open_doc_store, open_sentence_table):
+            close_cached(open_cached, "IndexEngine")
+
+    def close(self):
+        self.close_stores()
+        if self.snippet_executor is not None:
+            self.snippet_executor.shutdown()
+
+def close_cached(open_cached, directory_path):
+    """
+    Closes the store an lru_cached open_* function returned for the
+    directory, if it returned one, and empties its cache.
+    """
+    if open_cached.cache_info().currsize:
+        store = open_cached(directory_path)
+        if store is not None:
+            store.close()
+    open_cached.cache_clear()
+
+def manifest_mtime():
+    return os.stat(os.path.join("IndexEngine", MANIFEST_FILE)).st_mtime_ns
+
+def query_cache_key(query, stemmer, top_retrieved, mode):
+    """
+    Queries with the same (stemmed) terms and phrases get the same results and snippets.
+    """
+    phrases = tuple(tuple(tokenize_query(phrase, stemmer)) for phrase in split_phrases(query))
+    return tuple(tokenize_query(query, stemmer)), phrases, top_retrieved, mode
+
+def query_flow(index, time_budget_ms=None, cache=None):
     query = input("\033[94mEnter a query: \033[0m")
     start_time = time.time()
-    list_output = bm_25(inverted_index=inverted_index, lexicon=lexicon, mapping_to_docno=mapping_to_docno, doc_lengths=doc_lengths, queries=query, top_retrieved=10, testing=False)
-    end_time = time.time()
-    find_and_add_snippets(list_output, query)
+    index.refresh()
+    stemmer = index.stemmer
+    mode = "impact" if time_budget_ms is not None else "exhaustive"
+    if cache is not None:
+        key = query_cache_key(query, stemmer, 10, mode)
+        list_output = cache.get(key, index.version)
+    if cache is None or list_output is None:
+        list_output = bm_25(inverted_index=index.inverted_index, lexicon=index.lexicon, metadata=index.metadata, stats=index.stats, queries=query, top_retrieved=10, testing=False, use_stemming=stemmer is not None, stemmer=stemmer, positions=index.positions, mode=mode, impacts=index.impacts, time_budget_ms=time_budget_ms)
+        end_time = time.time()
+        find_and_add_snippets(list_output, query, stemmer=stemmer, executor=index.snippet_executor)
+        if cache is not None:
+            cache.put(key, index.version, list_output)
+    else:
+        end_time = time.time()
     print("Results:\n")
     if len(list_output) == 0:
         print(f"\033[91mNo documents found for the query: {query} \033[0m\n")
@@ -91,12 +143,20 @@ def query_flow(inverted_index, lexicon, mapping_to_docno, doc_lengths):
 
     return list_output
 
-def interactive_experience():
+def interactive_experience(use_stemming=False, time_budget_ms=None, cache_entries=DEFAULT_MAX_ENTRIES, cache_bytes=DEFAULT_MAX_BYTES, postings_cache_bytes=0, warm_up=None, snippet_workers=1):
     print("Welcome to the search engine!")
     print("Loading Data Structures...")
-    inverted_index, lexicon, mapping_to_docno, doc_lengths = create_and_load_data_structures()
-    print("Data Structures loaded successfully!")
-    list_output = query_flow(inverted_index, lexicon, mapping_to_docno, doc_lengths)
+    start_time = time.perf_counter()
+    # the impact ordered index is only used to rank within a time budget
+    index = EngineIndex(use_stemming, postings_cache_bytes, warm_up, time_budget_ms is not None, snippet_workers)
+    impacts = index.impacts
+    if time_budget_ms is not None and (impacts is None or (impacts.k1, impacts.b) != (index.stats.k1, index.stats.b)):
+        reason = "was built without --impacts" if impacts is None else f"has impacts for k1={impacts.k1} and b={impacts.b}"
+        print(f"\033[91mThe index {reason}, --time_budget_ms is ignored and queries are ranked exhaustively.\033[0m")
+        time_budget_ms = None
+    cache = QueryCache(cache_entries, cache_bytes) if cache_entries > 0 else None
+    print(f"Data Structures loaded successfully in {time.perf_counter() - start_time:.2f} seconds!")
+    list_output = query_flow(index, time_budget_ms, cache)
     user_input = input('\033[94mEnter rank to retrieve the document of that retrieved rank, "N" for new query, or "Q" to quit: \033[0m').upper()
     while user_input != "Q":
         if user_input.isdigit():
@@ -106,17 +166,36 @@ def interactive_experience():
             else:
                 print("\033[91mInvalid rank, please try again.\033[0m")
         elif user_input == "N":
-            list_output = query_flow(inverted_index, lexicon, mapping_to_docno, doc_lengths)
+            list_output = query_flow(index, time_budget_ms, cache)
         else:
             print("\033[91mInvalid input, please try again.\033[0m")
         user_input = input('\033[94mEnter rank to retrieve the document of that retrieved rank, "N" for new query, or "Q" to quit: \033[0m').upper()
     
+    index.close()
+    if cache is not None:
+        print(f"Query cache: {cache.hits} hits, {cache.misses} misses")
+    if isinstance(index.inverted_index, CachedPostingsReader):
+        print(f"Posting list cache: {index.inverted_index.hits} hits, {index.inverted_index.misses} misses")
     print("Thank you for using the search engine, goodbye!")
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Interactive Search Engine")
+    parser.add_argument('--use_stemming', action='store_true',
+                        help='If set and the index does not exist yet, it is built with stemming. Queries and snippets are stemmed whenever the index is.')
+    parser.add_argument('--time_budget_ms', type=float, default=None,
+                        help='If set, queries are ranked on the impact ordered index (built with --impacts) within this many milliseconds.')
+    parser.add_argument('--cache_entries', type=int, default=DEFAULT_MAX_ENTRIES,
+                        help='Maximum number of query results kept in the cache, 0 disables it.')
+    parser.add_argument('--cache_mb', type=float, default=DEFAULT_MAX_BYTES / (1024 * 1024),
+                        help='Maximum memory in MB used by the cached query results.')
+    parser.add_argument('--postings_cache_mb', type=float, default=0,
+                        help='If set, decoded posting lists are kept in a cache of this many MB.')
+    parser.add_argument('--warm_up', type=str, default=None,
+                        help='Queries JSON file whose most frequent terms are loaded into the posting list cache at start.')
+    parser.add_argument('--snippet_workers', type=int, default=1,
+                        help='Number of processes the snippets of the results are generated in.')
     
-    parser.parse_args()
+    args = parser.parse_args()
 
-    interactive_experience()
\ No newline at end of file
+    interactive_experience(args.use_stemming, args.time_budget_ms, args.cache_entries, int(args.cache_mb * 1024 * 1024), int(args.postings_cache_mb * 1024 * 1024), args.warm_up, args.snippet_workers)
\ No newline at end of file
@@ -0,0 +1,287 @@
+import os
+import json
+import time
+import asyncio
+import argparse
+from collections import deque
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ProcessPoolExecutor
+from BM25 import ranking_state, rank_query
+from IndexEngine import CachedStemmer
+from objects import RetrievalOutput
+from BinaryIndex import open_inverted_index, read_manifest
+from LexiconStore import open_lexicon
+from MetaDataStore import open_metadata_store
+from CollectionStats import load_collection_stats
+from Positions import open_positions
+from DocStore import open_doc_store
+from GetDoc import find_document
+from Snippets import find_and_add_snippets
+
+DEFAULT_TOP_K = 10
+MAX_TOP_K = 1000
+# latencies of the most recent requests of every endpoint kept for the percentiles
+LATENCY_WINDOW = 1000
+
+service_state = None
+
+
+def load_service_state(directory_path):
+    """
+    Opens the index in directory_path. Runs in the service process before the
+    worker pool is started, so forked workers inherit the opened index, and
+    in every worker that did not.
+    """
+    global service_state
+    if service_state is not None:
+        return
+    lexicon = open_lexicon(directory_path)
+    inverted_index = open_inverted_index(directory_path)
+    stats = load_collection_stats(directory_path, inverted_index)
+    stemmer = CachedStemmer() if read_manifest(directory_path)["use_stemming"] else None
+    service_state = {"directory_path": directory_path, "metadata": open_metadata_store(directory_path),
+                     "ranking": ranking_state(lexicon, inverted_index, stats, DEFAULT_TOP_K, "exhaustive", stemmer, open_positions(directory_path), None, "auto", {})}
+
+
+def search(query, top_k, with_snippets):
+    ranking = service_state["ranking"]
+    metadata = service_state["metadata"]
+    ranked_docs = rank_query(query, **{**ranking, "top_retrieved": top_k})
+    list_output = [RetrievalOutput(rank + 1, metadata.headline(doc_id), metadata.date(doc_id), metadata.docno(doc_id)) for rank, (doc_id, _) in enumerate(ranked_docs)]
+    if with_snippets:
+        find_and_add_snippets(list_output, query, stemmer=ranking["ps"], directory_path=service_state["directory_path"])
+    return [{"rank": output.rank, "docno": output.docno, "headline": output.headline, "date": output.date, "score": score, "snippet": output.query_biased_snippet}
+            for output, (_, score) in zip(list_output, ranked_docs)]
+
+
+def fetch_document(input_type, key):
+    directory_path = service_state["directory_path"]
+    doc_no, doc_id, meta_data = find_document(directory_path, input_type, key)
+    return {"docno": doc_no, "internal_id": doc_id, "date": meta_data["date"], "headline": meta_data["headline"].strip(),
+            "raw_document": open_doc_store(directory_path).get(doc_id)}
+
+
+def snippets(query, doc_nos):
+    metadata = service_state["metadata"]
+    list_output = []
+    for rank, doc_no in enumerate(doc_nos):
+        doc_id = metadata.doc_id(doc_no)
+        if doc_id is None:
+            raise ValueError(f"the doc no {doc_no} does not exist, input a valid doc no")
+        list_output.append(RetrievalOutput(rank + 1, metadata.headline(doc_id), metadata.date(doc_id), doc_no))
+    find_and_add_snippets(list_output, query, stemmer=service_state["ranking"]["ps"], directory_path=service_state["directory_path"])
+    return [{"docno": output.docno, "snippet": output.query_biased_snippet} for output in list_output]
+
+
+class LatencyMetrics:
+    """
+    Request count, errors and latency percentiles of one endpoint, over the
+    last LATENCY_WINDOW requests.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def record(self, status, seconds):
+        self.requests += 1
+        if status >= 400:
+            self.errors += 1
+        self.latencies.append(seconds * 1000)
+
+    def report(self):
+        latencies = sorted(self.latencies)
+        report = {"requests": self.requests, "errors": self.errors}
+        if latencies:
+            report["mean_ms"] = round(sum(latencies) / len(latencies), 3)
+            for percentile in (50, 95, 99):
+                report[f"p{percentile}_ms"] = round(latencies[min(len(latencies) - 1, len(latencies) * percentile // 100)], 3)
+            report["max_ms"] = round(latencies[-1], 3)
+        return report
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class SearchService:
+    """
+    JSON over HTTP search service. The index is opened once and the scoring,
+    snippet and document work runs in a pool of worker processes, so slow
+    requests don't hold up the others; the event loop only parses requests
+    and keeps the latency metrics.
+
+    Endpoints (GET):
+    - /search?q=QUERY[&k=10][&snippets=1]: The top k results, with snippets if asked.
+    - /doc?docno=DOCNO or /doc?id=ID: The metadata and raw text of a document.
+    - /snippets?q=QUERY&docno=DOCNO[&docno=...]: Query-biased snippets of the documents.
+    - /metrics: Request counts and latency percentiles per endpoint.
+    """
+
+    def __init__(self, directory_path, workers=1):
+        if not os.path.exists(directory_path):
+            raise ValueError("please provide a valid path to the index")
+        load_service_state(directory_path)
+        self.pool = ProcessPoolExecutor(workers, initializer=load_service_state, initargs=(directory_path,))
+        # start the workers now, not from inside the running event loop
+        self.pool.submit(load_service_state, directory_path).result()
+        self.routes = {"/search": self.search, "/doc": self.document, "/snippets": self.snippets, "/metrics": self.metrics_report}
+        self.metrics = {path: LatencyMetrics() for path in self.routes}
+        self.started = time.time()
+
+    async def run_in_pool(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.pool, function, *args)
+
+    async def search(self, params):
+        query = required_param(params, "q")
+        try:
+            top_k = int(params.get("k", [DEFAULT_TOP_K])[0])
+        except ValueError:
+            raise HTTPError(400, "k must be an integer")
+        if not 1 <= top_k <= MAX_TOP_K:
+            raise HTTPError(400, f"k must be between 1 and {MAX_TOP_K}")
+        with_snippets = params.get("snippets", ["0"])[0].lower() in ("1", "true", "yes")
+        return {"query": query, "results": await self.run_in_pool(search, query, top_k, with_snippets)}
+
+    async def document(self, params):
+        if "docno" in params:
+            input_type, key = "docno", params["docno"][0].strip().upper()
+        elif "id" in params:
+            input_type, key = "id", params["id"][0].strip()
+        else:
+            raise HTTPError(400, "missing parameter docno or id")
+        try:
+            return await self.run_in_pool(fetch_document, input_type, key)
+        except ValueError as error:
+            raise HTTPError(404, str(error))
+
+    async def snippets(self, params):
+        query = required_param(params, "q")
+        doc_nos = [doc_no.strip().upper() for doc_no in params.get("docno", [])]
+        if not doc_nos:
+            raise HTTPError(400, "missing parameter docno")
+        try:
+            return {"query": query, "snippets": await self.run_in_pool(snippets, query, doc_nos)}
+        except ValueError as error:
+            raise HTTPError(404, str(error))
+
+    async def metrics_report(self, params):
+        return {"uptime_seconds": round(time.time() - self.started, 3), "endpoints": {path: metrics.report() for path, metrics in self.metrics.items()}}
+
+    async def handle_request(self, method, target):
+        url = urlsplit(target)
+        handler = self.routes.get(url.path)
+        if handler is None:
+            raise HTTPError(404, f"unknown endpoint {url.path}")
+        if method != "GET":
+            raise HTTPError(405, f"{method} is not supported, use GET")
+        return await handler(parse_qs(url.query))
+
+    async def handle_connection(self, reader, writer):
+        """
+        Serves the requests of one connection, keeping it open between
+        requests unless the client asks to close it.
+        """
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, target, headers = request
+                start_time = time.perf_counter()
+                try:
+                    status, body = 200, await self.handle_request(method, target)
+                except HTTPError as error:
+                    status, body = error.status, {"error": str(error)}
+                except Exception as error:
+                    status, body = 500, {"error": f"{type(error).__name__}: {error}"}
+                elapsed = time.perf_counter() - start_time
+                path = urlsplit(target).path
+                if path in self.metrics:
+                    self.metrics[path].record(status, elapsed)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                writer.write(http_response(status, body, keep_alive, elapsed))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"Serving on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.pool.shutdown()
+
+
+def required_param(params, name):
+    value = params.get(name, [""])[0]
+    if not value.strip():
+        raise HTTPError(400, f"missing parameter {name}")
+    return value
+
+
+async def read_request(reader):
+    """
+    Returns the (method, target, headers) of the next request of the
+    connection, or None once the client closed it.
+    """
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    parts = request_line.decode("latin-1").split()
+    if len(parts) != 3:
+        raise ValueError("malformed request line")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    content_length = int(headers.get("content-length", 0))
+    if content_length:
+        await reader.readexactly(content_length)
+    return parts[0], parts[1], headers
+
+
+def http_response(status, body, keep_alive, elapsed):
+    data = json.dumps(body).encode("utf-8")
+    head = (f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+            f"X-Response-Time-Ms: {elapsed * 1000:.3f}\r\n"
+            "\r\n")
+    return head.encode("latin-1") + data
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve BM25 search, documents and snippets as JSON over HTTP.")
+    parser.add_argument('directory_path', type=str,
+                        help='Path to the directory containing the index files.')
+    parser.add_argument('--host', type=str, default="127.0.0.1",
+                        help='Address the service listens on.')
+    parser.add_argument('--port', type=int, default=8080,
+                        help='Port the service listens on.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Number of processes requests are scored in.')
+
+    args = parser.parse_args()
+
+    service = SearchService(args.directory_path, args.workers)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
@@ -0,0 +1,153 @@
+import os
+import json
+import zlib
+from array import array
+from functools import lru_cache
+from itertools import accumulate
+from BinaryIndex import PostingsWriter, PostingsReader
+from DocStore import DocStore
+from GetDoc import remove_tags
+from LexiconStore import LexiconStore, open_lexicon
+
+SENTENCES_FILE = "sentences.bin"
+SENTENCE_TERMS_FILE = "sentence-terms.json"
+SENTENCES_MAGIC = b"SENTNCS1"
+
+
+def load_sentence_terms(directory_path):
+    terms_path = os.path.join(directory_path, SENTENCE_TERMS_FILE)
+    if not os.path.exists(terms_path):
+        return []
+    with open(terms_path, "r") as file:
+        return json.load(file)
+
+
+def token_code(token, lexicon, sentence_terms):
+    """
+    Returns the code of a token in the sentence table: 2 * term id for tokens
+    of the lexicon and 2 * id + 1 for the tokens only seen in snippet text
+    (document numbers, bylines, ...), or None for unknown tokens. Tokens that
+    were snippet only once keep their code after they join the lexicon.
+    """
+    term_id = sentence_terms.get(token)
+    if term_id is not None:
+        return 2 * term_id + 1
+    term_id = lexicon.get(token)
+    if term_id is not None:
+        return 2 * term_id
+    return None
+
+
+def encode_sentences(doc_content, lexicon, sentence_terms, tokenize):
+    """
+    Encodes the sentences of a document as their lengths in characters,
+    their number of tokens and the codes of all their tokens, in 16 bit
+    integers when they all fit. New snippet only tokens are added to
+    sentence_terms.
+    """
+    sentences = doc_content.split(".")
+    values = array("I", [len(sentences)])
+    values.extend(len(sentence) for sentence in sentences)
+    codes = array("I")
+    for sentence in sentences:
+        tokens = tokenize(sentence)
+        for token in tokens:
+            code = token_code(token, lexicon, sentence_terms)
+            if code is None:
+                sentence_terms[token] = len(sentence_terms)
+                code = 2 * sentence_terms[token] + 1
+            codes.append(code)
+        values.append(len(tokens))
+    values.extend(codes)
+    typecode = "H" if max(values) <= 0xFFFF else "I"
+    return typecode.encode("ascii") + zlib.compress(array(typecode, values).tobytes())
+
+
+def decode_sentences(data):
+    """
+    Returns the (starts, token_counts, codes) of an encoded document, where
+    starts are the offsets of the sentences in the document text.
+    """
+    values = array(chr(data[0]))
+    values.frombytes(zlib.decompress(data[1:]))
+    num_sentences = values[0]
+    lengths = values[1:num_sentences + 1]
+    # every sentence but the last is followed by the "." it was split on
+    starts = list(accumulate((length + 1 for length in lengths[:-1]), initial=0))
+    return starts, values[num_sentences + 1:2 * num_sentences + 1], values[2 * num_sentences + 1:]
+
+
+def write_sentence_table(directory_path, lexicon, tokenize):
+    """
+    Writes the sentence table of the documents in the document store, so
+    snippets are scored on token codes without tokenizing the documents.
+    Documents already in an existing table are copied, only the new ones
+    are read and tokenized.
+
+    Parameters:
+    - directory_path: The index directory.
+    - lexicon: The {token: term_id} lexicon of the index.
+    - tokenize: A function returning the tokens of a sentence, as the snippets tokenize it.
+    """
+    table_path = os.path.join(directory_path, SENTENCES_FILE)
+    terms = load_sentence_terms(directory_path)
+    sentence_terms = {token: term_id for term_id, token in enumerate(terms)}
+    doc_store = DocStore(directory_path)
+    with PostingsWriter(table_path + ".tmp", magic=SENTENCES_MAGIC) as writer:
+        first_doc_id = 0
+        if os.path.exists(table_path):
+            table = PostingsReader(table_path, magic=SENTENCES_MAGIC)
+            first_doc_id = len(table)
+            for doc_id in range(first_doc_id):
+                writer.add_encoded(table.encoded(doc_id), table.doc_frequency(doc_id))
+            table.close()
+        for doc_id in range(first_doc_id, len(doc_store)):
+            doc_content = remove_tags(doc_store.get(doc_id)).strip()
+            writer.add_encoded(encode_sentences(doc_content, lexicon, sentence_terms, tokenize), doc_content.count(".") + 1)
+    doc_store.close()
+    os.replace(table_path + ".tmp", table_path)
+
+    terms.extend(list(sentence_terms)[len(terms):])
+    with open(os.path.join(directory_path, SENTENCE_TERMS_FILE), "w") as file:
+        json.dump(terms, file)
+
+
+class SentenceTable:
+    """
+    The precomputed sentences of every document, by internal id, and the
+    token codes of the query tokens.
+    """
+
+    def __init__(self, directory_path, lexicon):
+        self.reader = PostingsReader(os.path.join(directory_path, SENTENCES_FILE), magic=SENTENCES_MAGIC)
+        self.lexicon = lexicon
+        self.sentence_terms = {token: term_id for term_id, token in enumerate(load_sentence_terms(directory_path))}
+
+    def __len__(self):
+        return len(self.reader)
+
+    def sentences(self, doc_id):
+        return decode_sentences(self.reader.encoded(doc_id))
+
+    def query_codes(self, query_tokens):
+        """
+        Codes of the query tokens. Unknown tokens are in no sentence, so they
+        are dropped.
+        """
+        codes = (token_code(token, self.lexicon, self.sentence_terms) for token in query_tokens)
+        return [code for code in codes if code is not None]
+
+    def close(self):
+        self.reader.close()
+        if isinstance(self.lexicon, LexiconStore):
+            self.lexicon.close()
+
+
+@lru_cache(maxsize=None)
+def open_sentence_table(directory_path):
+    """
+    Returns the sentence table of the index, or None when it was built without one.
+    """
+    if not os.path.exists(os.path.join(directory_path, SENTENCES_FILE)):
+        return None
+    return SentenceTable(directory_path, open_lexicon(directory_path))
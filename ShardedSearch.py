@@ -0,0 +1,173 @@
+import os
+import heapq
+import argparse
+from bisect import bisect_left
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from BM25 import ranking_state, rank_query, tokenize_query, write_to_txt, read_json
+from IndexEngine import CachedStemmer
+from objects import RetrievalTestingOutput
+from BinaryIndex import PostingsReader, SkipLists, read_manifest, positions_file_for, skips_file_for, POSITIONS_MAGIC
+from Positions import PositionsReader
+from CollectionStats import load_collection_stats, STATS_FILE
+from LexiconStore import open_lexicon
+from PostingsCache import cache_postings
+from Accumulators import BACKENDS
+
+# the lists of a query are still cached when the tie keys are looked up on an index without skips
+SHARD_CACHE_BYTES = 64 * 1024 * 1024
+
+shard_state = None
+shard_skip_lists = None
+
+
+def load_shard(directory_path, segment, k1, b, top_retrieved, use_stemming, backend):
+    """
+    Opens one segment of the index in a shard worker. The lexicon and the
+    collection statistics are those of the whole index, so the scores are
+    the same as on the unsharded index.
+    """
+    global shard_state, shard_skip_lists
+    lexicon = open_lexicon(directory_path)
+    inverted_index = cache_postings(PostingsReader(os.path.join(directory_path, segment)), SHARD_CACHE_BYTES)
+    stats = load_collection_stats(directory_path, None, k1, b)
+    positions = None
+    if read_manifest(directory_path).get("positions"):
+        positions = PositionsReader([PostingsReader(os.path.join(directory_path, positions_file_for(segment)), magic=POSITIONS_MAGIC)])
+    if os.path.exists(os.path.join(directory_path, skips_file_for(segment))):
+        shard_skip_lists = SkipLists(directory_path, [segment])
+    ps = CachedStemmer() if use_stemming else None
+    shard_state = ranking_state(lexicon, inverted_index, stats, top_retrieved, "exhaustive", ps, positions, None, backend, {})
+
+
+def rank_shard(query_text):
+    """
+    Returns the top [(doc_id, score, term_rank), ...] of the query in this shard.
+    """
+    ranked_docs = rank_query(query_text, **shard_state)
+    lexicon = shard_state["lexicon"]
+    term_ids = [lexicon[token] for token in tokenize_query(query_text, shard_state["ps"]) if token in lexicon]
+    return with_term_ranks(ranked_docs, term_ids, shard_state["inverted_index"], shard_skip_lists)
+
+
+def with_term_ranks(ranked_docs, term_ids, inverted_index, skip_lists=None):
+    """
+    Adds to every (doc_id, score) the rank of the first query term whose
+    posting list contains the document. The exhaustive ranking orders
+    documents with the same score by it, then by doc id.
+    With skip lists every term is probed with a skip cursor at the returned
+    documents that no earlier term contains, in doc id order, so only the
+    blocks holding them are decoded; without them the lists are decoded.
+    """
+    unique_term_ids = list(dict.fromkeys(term_ids))
+    term_ranks = {}
+    unranked = sorted(doc_id for doc_id, _ in ranked_docs)
+    for term_rank, term_id in enumerate(unique_term_ids):
+        if not unranked:
+            break
+        remaining = []
+        if skip_lists is not None:
+            cursor = skip_lists.cursor(term_id)
+            for doc_id in unranked:
+                if cursor.next_geq(doc_id) == doc_id:
+                    term_ranks[doc_id] = term_rank
+                else:
+                    remaining.append(doc_id)
+        else:
+            doc_ids = inverted_index.postings(term_id)[0::2]
+            for doc_id in unranked:
+                i = bisect_left(doc_ids, doc_id)
+                if i < len(doc_ids) and doc_ids[i] == doc_id:
+                    term_ranks[doc_id] = term_rank
+                else:
+                    remaining.append(doc_id)
+        unranked = remaining
+    return [(doc_id, score, term_ranks.get(doc_id, len(unique_term_ids))) for doc_id, score in ranked_docs]
+
+
+def merge_shard_rankings(shard_rankings, top_retrieved):
+    """
+    Merges the per shard top k lists into the top k [(doc_id, score), ...] of
+    the whole index. Every shard list is already sorted by score, term rank
+    and doc id, like the exhaustive ranking, so merging on the same key gives
+    exactly the unsharded ranking.
+    """
+    merged = heapq.merge(*shard_rankings, key=lambda result: (-result[1], result[2], result[0]))
+    return [(doc_id, score) for doc_id, score, _ in islice(merged, top_retrieved)]
+
+
+class ShardedSearcher:
+    """
+    Scatter-gather BM25 over a document partitioned index. Every segment of
+    the index (see IndexEngine.py --shards) is a shard searched by its own
+    worker process; a query is sent to all of them and their top k lists
+    are merged.
+    """
+
+    def __init__(self, directory_path, top_retrieved=1000, k1=1.2, b=0.75, use_stemming=False, backend="auto"):
+        if not os.path.exists(os.path.join(directory_path, STATS_FILE)):
+            raise ValueError(f"Sharded search needs the collection statistics written by IndexEngine in {directory_path}")
+        self.top_retrieved = top_retrieved
+        self.workers = [ProcessPoolExecutor(1, initializer=load_shard, initargs=(directory_path, segment, k1, b, top_retrieved, use_stemming, backend))
+                        for segment in read_manifest(directory_path)["segments"]]
+
+    def search(self, query_text):
+        return next(self.search_many([query_text]))
+
+    def search_many(self, queries):
+        """
+        Yields the ranking of every query, in order. All queries are sent to
+        the shards up front, so the shards are never idle between queries.
+        """
+        pending = [[worker.submit(rank_shard, query_text) for worker in self.workers] for query_text in queries]
+        for futures in pending:
+            yield merge_shard_rankings([future.result() for future in futures], self.top_retrieved)
+
+    def close(self):
+        for worker in self.workers:
+            worker.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def sharded_bm_25(directory_path, queries_path, file_output, k1=1.2, b=0.75, top_retrieved=1000, use_stemming=False, backend="auto"):
+    if not os.path.exists(directory_path) or not os.path.exists(queries_path):
+        raise ValueError("Please provide a valid path to the contents being retrieved")
+    queries = read_json(queries_path)
+    mapping_to_docno = read_json("mapping.json")["doc_nos"]
+    with ShardedSearcher(directory_path, top_retrieved, k1, b, use_stemming, backend) as searcher:
+        rankings = zip(queries, searcher.search_many(queries.values()))
+        write_to_txt((RetrievalTestingOutput(topic_number, mapping_to_docno[doc_id], rank + 1, score)
+                      for topic_number, ranked_docs in rankings
+                      for rank, (doc_id, score) in enumerate(ranked_docs)), file_output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Perform BM25 retrieval on a sharded index, one worker process per shard.'
+    )
+
+    parser.add_argument('directory_path', type=str,
+                        help='Path to the directory containing the index files.')
+    parser.add_argument('queries_path', type=str,
+                        help='Path to the queries JSON file.')
+    parser.add_argument('file_output', type=str,
+                        help='Path to the output file where results will be stored.')
+    parser.add_argument('--use_stemming', action='store_true',
+                        help='If set, the query will be stemmed using Porter Stemmer.')
+    parser.add_argument('--k1', type=float, default=1.2,
+                        help='BM25 k1.')
+    parser.add_argument('--b', type=float, default=0.75,
+                        help='BM25 b.')
+    parser.add_argument('--top_retrieved', type=int, default=1000,
+                        help='Number of results per topic.')
+    parser.add_argument('--backend', choices=BACKENDS, default="auto",
+                        help='Score with NumPy (numpy), plain Python (python), or NumPy when it is installed (auto).')
+
+    args = parser.parse_args()
+
+    sharded_bm_25(args.directory_path, args.queries_path, args.file_output, args.k1, args.b, args.top_retrieved, args.use_stemming, args.backend)
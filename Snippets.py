@@ -0,0 +1,142 @@
+import heapq
+import textwrap
+from math import sqrt, log
+from collections import Counter
+from itertools import repeat
+from IndexEngine import TokenizeStrings, TokenizeText, CachedStemmer
+from GetDoc import return_data_batch, find_doc_id
+from SentenceTable import open_sentence_table
+
+worker_stemmer = None
+
+
+def tokenize_snippet_query(query, stemmer=None):
+    query_tokens = []
+    TokenizeStrings(query.split(" "), query_tokens, stemmer)
+    return query_tokens
+
+
+def query_biased_snippet(doc_content, query_tokens, k=3, stemmer=None):
+    """
+    Returns the k sentences of the document most similar to the query, by
+    cosine similarity of their tf-idf vectors where the sentences are the
+    documents of the idf, joined into a snippet. The number of sentences
+    containing each token is counted once per document and every sentence
+    is scored in one pass over its tokens, so a document takes linear time.
+    """
+    sentences = doc_content.split(".")
+    sentence_counts = []
+    sentence_frequencies = Counter()
+    for sentence in sentences:
+        tokens = []
+        TokenizeText(sentence, tokens, stemmer)
+        counts = Counter(tokens)
+        sentence_counts.append(counts)
+        sentence_frequencies.update(counts.keys())
+    top_k_sentences = best_sentences(len(sentences), sentence_counts, sentence_frequencies, query_tokens, k)
+    return join_snippet([sentences[i] for i in top_k_sentences])
+
+
+def table_sentences(table, doc_id, query_codes, k=3):
+    """
+    query_biased_snippet on the precomputed sentences of the document (see
+    SentenceTable.py), which are already token codes. Returns the (start,
+    end) offsets of the chosen sentences in the document text, the only
+    text the snippet needs.
+    """
+    starts, token_counts, codes = table.sentences(doc_id)
+    query_set = set(query_codes)
+    sentence_counts = []
+    sentence_frequencies = Counter()
+    offset = 0
+    for token_count in token_counts:
+        sentence_codes = codes[offset:offset + token_count]
+        offset += token_count
+        distinct_codes = set(sentence_codes)
+        sentence_frequencies.update(distinct_codes)
+        # only sentences with a query token are scored, the others need no counts
+        sentence_counts.append(Counter(sentence_codes) if not query_set.isdisjoint(distinct_codes) else distinct_codes)
+    num_sentences = len(starts)
+    top_k_sentences = best_sentences(num_sentences, sentence_counts, sentence_frequencies, query_codes, k)
+    return [(starts[i], starts[i + 1] - 1 if i + 1 < num_sentences else None) for i in top_k_sentences]
+
+
+def best_sentences(num_sentences, sentence_counts, sentence_frequencies, query_tokens, k):
+    """
+    Returns the indices of the k sentences most similar to the query, scored
+    from their token counts. The weights are summed in the same order as the
+    original per sentence tf-idf vectors, so the similarities, and the
+    snippets, are exactly the same.
+    """
+    idf = {token: log((num_sentences + 1) / (1 + ni)) for token, ni in sentence_frequencies.items()}
+    query_vector = {token: count * idf[token] for token, count in Counter(query_tokens).items() if token in idf}
+    query_magnitude = sqrt(sum(weight ** 2 for weight in query_vector.values()))
+
+    similarities = [0] * num_sentences
+    if query_magnitude:
+        for i, counts in enumerate(sentence_counts):
+            # sentences without a query token have a similarity of 0
+            if not any(token in counts for token in query_vector):
+                continue
+            sentence_vector = {token: count * idf[token] for token, count in counts.items()}
+            dot_product = sum(query_vector[token] * sentence_vector.get(token, 0) for token in query_vector)
+            sentence_magnitude = sqrt(sum(weight ** 2 for weight in sentence_vector.values()))
+            similarities[i] = dot_product / (query_magnitude * sentence_magnitude) if sentence_magnitude else 0
+
+    return heapq.nlargest(k, range(num_sentences), key=similarities.__getitem__)
+
+
+def join_snippet(sentences):
+    best_snippet = " ".join([sentence.strip() for sentence in sentences])
+    best_snippet = best_snippet.replace("\n", "")
+    if not best_snippet.endswith(".") or not best_snippet.endswith("!") or not best_snippet.endswith("?"):
+        best_snippet += "."
+    return best_snippet
+
+
+def pooled_snippet(doc_content, query_tokens, k, use_stemming):
+    """
+    query_biased_snippet in a worker process, which keeps its own stemmer
+    instead of receiving the cache of the caller's.
+    """
+    global worker_stemmer
+    if use_stemming and worker_stemmer is None:
+        worker_stemmer = CachedStemmer()
+    return query_biased_snippet(doc_content, query_tokens, k, worker_stemmer if use_stemming else None)
+
+
+def pooled_table_sentences(directory_path, doc_id, query_codes, k):
+    """
+    table_sentences in a worker process, which opens the sentence table itself.
+    """
+    return table_sentences(open_sentence_table(directory_path), doc_id, query_codes, k)
+
+
+def find_and_add_snippets(list_output, query, k=3, stemmer=None, directory_path="IndexEngine", executor=None):
+    """
+    Adds a query-biased snippet to every result, and a headline made from it
+    to results without one. The query is tokenized once and, with an
+    executor, the snippets of the results are generated concurrently. When
+    the index has a sentence table the sentences are chosen from it and the
+    documents are only read to cut out the chosen ones.
+    """
+    doc_nos = [output.docno for output in list_output]
+    query_tokens = tokenize_snippet_query(query, stemmer)
+    table = open_sentence_table(directory_path)
+    if table is not None:
+        doc_ids = [find_doc_id(doc_no, directory_path) for doc_no in doc_nos]
+        query_codes = table.query_codes(query_tokens)
+        if executor is None:
+            chosen_sentences = [table_sentences(table, doc_id, query_codes, k) for doc_id in doc_ids]
+        else:
+            chosen_sentences = executor.map(pooled_table_sentences, repeat(directory_path), doc_ids, repeat(query_codes), repeat(k))
+        best_snippets = [join_snippet([doc_content[start:end] for start, end in spans])
+                         for doc_content, spans in zip(return_data_batch(doc_nos, directory_path), chosen_sentences)]
+    elif executor is None:
+        best_snippets = [query_biased_snippet(doc_content, query_tokens, k, stemmer) for doc_content in return_data_batch(doc_nos, directory_path)]
+    else:
+        best_snippets = executor.map(pooled_snippet, return_data_batch(doc_nos, directory_path), repeat(query_tokens), repeat(k), repeat(stemmer is not None))
+    for output, best_snippet in zip(list_output, best_snippets):
+        if not output.headline:
+            output.headline = best_snippet[:50] + "..."
+        output.add_snippet(textwrap.fill(best_snippet, width=80))
@@ -0,0 +1,47 @@
+import os
+import gzip
+import pytest
+from IndexEngine import unzip_file_and_read
+from BinaryIndex import split_segments
+from RunEngine import EngineIndex, query_flow
+
+WORDS = ["nuclear", "energy", "safety", "runs", "renewable", "power", "plant", "reactor"]
+
+
+def write_collection(path, num_docs):
+    with gzip.open(path, "wt") as file:
+        for doc in range(1, num_docs + 1):
+            text = " ".join(WORDS[(doc * i) % len(WORDS)] for i in range(1, 40))
+            file.write(f"<DOC>\n<DOCNO> LA010189-{doc:04d} </DOCNO>\n<DOCID> {doc} </DOCID>\n"
+                       f"<HEADLINE>\n<P>\n{WORDS[doc % len(WORDS)]} headline\n</P>\n</HEADLINE>\n"
+                       f"<TEXT>\n<P>\n{text}. {text}.\n</P>\n</TEXT>\n</DOC>\n")
+
+
+def open_fds():
+    return len(os.listdir("/proc/self/fd"))
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="counts the open files through /proc")
+def test_reload_closes_the_old_index(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr("builtins.input", lambda prompt: "nuclear safety")
+    write_collection("latimes.gz", 60)
+    unzip_file_and_read("latimes.gz", "IndexEngine", positions=True, impacts=True, sentences=True)
+    fds_before = open_fds()
+
+    index = EngineIndex()
+    query_flow(index)
+    version = index.version
+    fds_per_reload = []
+    for _ in range(4):
+        # bumps the version and rewrites the segments without changing how many files the index has
+        split_segments("IndexEngine", 2)
+        results = query_flow(index)
+        assert index.version > version
+        version = index.version
+        assert results
+        fds_per_reload.append(open_fds())
+    index.close()
+
+    assert len(set(fds_per_reload)) == 1
+    assert open_fds() == fds_before
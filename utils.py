@@ -3,6 +3,15 @@ import shutil
 import re
 import argparse
 import json
+import time
+from IndexEngine import TokenizeCharByChar, TokenizeText, IterTokens, CachedStemmer
+from BinaryIndex import open_inverted_index, open_skip_lists, read_manifest
+from CollectionStats import load_collection_stats
+from Positions import open_positions
+from ImpactIndex import open_impact_index
+from LexiconStore import open_lexicon
+from BM25 import rank_query, tokenize_query, phrase_matches
+from DynamicPruning import maxscore_top_k
 
 def gzip_file(input_file_path, output_file_path):
     """
@@ -44,6 +53,104 @@ def create_queries(base_file, output_file):
     print("Queries have been saved to 'queries.json'")
 
 
+def benchmark_tokenizer(input_file, max_docs=None):
+    """
+    Times the character by character tokenizer against the regex tokenizer on
+    the documents of a TREC formatted gzip file and checks that both produce
+    identical tokens for every document.
+
+    Parameters:
+    - input_file: Path to the gzip file, e.g. latimes.gz.
+    - max_docs: Optional limit on the number of documents used.
+    """
+    with gzip.open(input_file, 'rt') as file:
+        documents = file.read().split("</DOC>")
+    if max_docs:
+        documents = documents[:max_docs]
+
+    start = time.perf_counter()
+    char_by_char_tokens = []
+    for document in documents:
+        tokens = []
+        for string in document.split(" "):
+            TokenizeCharByChar(string, tokens)
+        char_by_char_tokens.append(tokens)
+    char_by_char_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    regex_tokens = []
+    for document in documents:
+        tokens = []
+        TokenizeText(document, tokens)
+        regex_tokens.append(tokens)
+    regex_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    generator_tokens = [list(IterTokens(document)) for document in documents]
+    generator_time = time.perf_counter() - start
+
+    mismatches = sum(1 for old, new, lazy in zip(char_by_char_tokens, regex_tokens, generator_tokens) if old != new or old != lazy)
+    num_tokens = sum(len(tokens) for tokens in char_by_char_tokens)
+
+    print(f"Documents: {len(documents)}, tokens: {num_tokens}")
+    print(f"Character by character: {char_by_char_time:.3f} seconds")
+    print(f"Regex (TokenizeText):   {regex_time:.3f} seconds ({char_by_char_time / regex_time:.1f}x)")
+    print(f"Regex (IterTokens):     {generator_time:.3f} seconds ({char_by_char_time / generator_time:.1f}x)")
+    print(f"Documents with different tokens: {mismatches}")
+
+
+def maxscore_query(query_text, lexicon, inverted_index, stats, top_k, ps, positions, skip_lists):
+    """
+    Returns the top [(doc_id, score), ...] of the query with MaxScore. It is
+    not a mode of BM25.py: on the collections we measured it decodes nearly
+    every posting anyway and is slower than the exhaustive scorer.
+    """
+    term_ids = [lexicon[token] for token in tokenize_query(query_text, ps) if token in lexicon]
+    matches = phrase_matches(query_text, lexicon, inverted_index, positions, ps) if positions else None
+    return maxscore_top_k(term_ids, inverted_index, stats, top_k, matches, skip_lists)
+
+
+def compare_bm25_modes(directory_path, queries_path, top_k=10, mode="maxscore"):
+    """
+    Ranks every query of a queries JSON file exhaustively and with another
+    BM25 mode or MaxScore, reporting the time of both and the topics whose top k differ
+    in documents, order or scores.
+
+    Parameters:
+    - directory_path: Path to the directory containing the index files.
+    - queries_path: Path to the queries JSON file, e.g. the TREC topics.
+    - top_k: Number of results compared per topic.
+    - mode: The BM25 mode (or maxscore) compared against the exhaustive scorer.
+    """
+    with open(queries_path, 'r') as file:
+        queries = json.load(file)
+    lexicon = open_lexicon(directory_path)
+    inverted_index = open_inverted_index(directory_path)
+    stats = load_collection_stats(directory_path, inverted_index)
+    positions = open_positions(directory_path)
+    stemmer = CachedStemmer.from_index(directory_path) if read_manifest(directory_path)["use_stemming"] else None
+    impacts = None
+    if mode == "impact":
+        impacts = open_impact_index(directory_path)
+        if impacts is None:
+            raise ValueError(f"The impact mode needs an index built with --impacts, {directory_path} has none")
+    skip_lists = open_skip_lists(directory_path) if mode == "maxscore" else None
+
+    rankings = {}
+    for compared_mode in ("exhaustive", mode):
+        start = time.perf_counter()
+        if compared_mode == "maxscore":
+            rankings[compared_mode] = {topic: maxscore_query(query, lexicon, inverted_index, stats, top_k, stemmer, positions, skip_lists) for topic, query in queries.items()}
+        else:
+            rankings[compared_mode] = {topic: rank_query(query, lexicon, inverted_index, stats, top_k, compared_mode, stemmer, positions, impacts) for topic, query in queries.items()}
+        print(f"{compared_mode}: {time.perf_counter() - start:.3f} seconds")
+
+    different = [topic for topic in queries if rankings["exhaustive"][topic] != rankings[mode][topic]]
+    print(f"Topics: {len(queries)}, top {top_k} different from the exhaustive ranking: {len(different)}")
+    for topic in different:
+        print(f"  {topic}: {queries[topic]}")
+
+
 def main():
     parser = argparse.ArgumentParser(description="Gzip file compression and topic queries extraction.")
     
@@ -57,12 +164,26 @@ def main():
     parser_query.add_argument('--base-file', '-b', help="Path to the base file containing topics for query extraction.", required=True)
     parser_query.add_argument('--output-file', '-o', help="Path to the output json of queries.", required=True)
     
+    parser_benchmark = subparsers.add_parser('benchmark-tokenizer', help="Compare the speed and output of the two tokenizers.")
+    parser_benchmark.add_argument('--input', '-i', help="Path to the gzip file with the documents, e.g. latimes.gz.", required=True)
+    parser_benchmark.add_argument('--max-docs', '-n', type=int, help="Only use the first n documents.", default=None)
+    
+    parser_compare = subparsers.add_parser('compare-bm25', help="Check that a BM25 mode returns the exhaustive ranking.")
+    parser_compare.add_argument('--index', '-d', help="Path to the directory containing the index files.", required=True)
+    parser_compare.add_argument('--queries', '-q', help="Path to the queries JSON file.", required=True)
+    parser_compare.add_argument('--top-k', '-k', type=int, help="Number of results compared per topic.", default=10)
+    parser_compare.add_argument('--mode', '-m', choices=("maxscore", "impact"), help="The BM25 mode compared against the exhaustive scorer.", default="maxscore")
+    
     args = parser.parse_args()
 
     if args.command == 'gzip':
         gzip_file(args.gzip_input, args.gzip_output)
     elif args.command == 'query':
         create_queries(args.base_file, args.output_file)
+    elif args.command == 'benchmark-tokenizer':
+        benchmark_tokenizer(args.input, args.max_docs)
+    elif args.command == 'compare-bm25':
+        compare_bm25_modes(args.index, args.queries, args.top_k, args.mode)
     else:
         parser.print_help()
 